@@ -0,0 +1,151 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+#query parameters that only track where a click came from, and never change the page
+tracking_params = {'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', 'oc', 'ocid', 'cmpid', 'ito', '_ga', 'at_medium', 'at_campaign'}
+
+
+
+
+def canonical_url(url):
+    '''
+    Helper function.  Normalizes a URL so that different spellings of the same link are recognized as one:
+    lowercases the scheme and host, drops the default port, the fragment, a trailing slash and tracking
+    parameters (utm_*, fbclid, Google News' oc, ...), and sorts the remaining query parameters.
+
+    :param
+        url - the URL to normalize
+
+    :return:
+        the canonical form of the URL, as a string
+    '''
+
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ''
+    if parts.port and not (scheme, parts.port) in (('http', 80), ('https', 443)):
+        host = host + ':' + str(parts.port)
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/') or '/'
+
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not (k.lower() in tracking_params or k.lower().startswith('utm_'))]
+    query = urlencode(sorted(query))
+
+    return urlunsplit((scheme, host, path, query, ''))
+
+
+
+
+
+
+
+class ArticleCache:
+    '''
+    On-disk cache of scraped articles, keyed by canonical URL.  Each entry is a gzipped JSON file holding
+    the raw HTML and the extracted text, stored under the SHA-256 of the canonical URL so that a lookup
+    never has to scan the directory.  When the cache grows past max_bytes, the least recently used
+    entries are deleted.
+
+    Attributes:
+        directory - where the entries are stored
+        max_bytes - the largest the cache may grow.  Once past it, entries are evicted down to 90% of it,
+                    so that eviction doesn't run on every write.  None means unbounded.
+        offline - if True, callers should never go to the network on a miss
+        size - the current size of the cache in bytes, computed lazily
+        lock - guards 'size' and eviction, since build_corpus writes from several threads
+    '''
+
+    def __init__(self, directory='cache/articles', max_bytes=2 * 1024 ** 3, offline=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.size = None
+        self.lock = threading.Lock()
+
+
+    def path(self, url):
+        digest = hashlib.sha256(canonical_url(url).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.json.gz')
+
+
+    def get(self, url):
+        '''
+        :return:
+            a dict with the keys 'url', 'html', 'text' and 'fetched', or None on a miss
+        '''
+
+        path = self.path(url)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as fp:
+                entry = json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+        #mark as recently used for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+
+    def put(self, url, html, text):
+        path = self.path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        entry = {'url' : canonical_url(url),
+                 'html' : html,
+                 'text' : text,
+                 'fetched' : time.time()}
+        tmp = path + '.' + str(threading.get_ident()) + '.tmp'
+        with gzip.open(tmp, 'wt', encoding='utf-8') as fp:
+            json.dump(entry, fp)
+
+        with self.lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp, path)
+            if self.size is not None:
+                self.size += os.path.getsize(path) - old_size
+            self.evict()
+
+
+    def entries(self):
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.json.gz'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+
+    def evict(self):
+        '''
+        Deletes least recently used entries until the cache is under max_bytes.  The caller holds the lock.
+        '''
+
+        if self.max_bytes is None:
+            return
+        if self.size is None:
+            self.size = sum(size for path, size, mtime in self.entries())
+        if self.size <= self.max_bytes:
+            return
+
+        for path, size, mtime in sorted(self.entries(), key=lambda e: e[2]):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+            if self.size <= self.max_bytes * 0.9:
+                break
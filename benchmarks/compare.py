@@ -0,0 +1,72 @@
+'''
+Compares two benchmark results files, e.g. before and after a change:
+
+    python -m benchmarks.compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+Exits with status 1 if any stage got slower by more than the threshold.
+'''
+
+import argparse
+import json
+import math
+import sys
+
+
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as fp:
+        data = json.load(fp)
+    return data['label'], {(r['stage'], r['size']) : r['seconds'] for r in data['results']}
+
+
+
+
+
+def compare(base_path, head_path, threshold=1.10):
+    '''
+    Prints each stage's time in both files, and their ratio.
+
+    :param
+        threshold - head / base ratios above this are flagged as regressions
+
+    :return:
+        a list of the (stage, size) keys that regressed
+    '''
+
+    base_label, base = load_results(base_path)
+    head_label, head = load_results(head_path)
+
+    print('{:<28} {:>6} {:>12} {:>12} {:>8}'.format('stage', 'size', base_label[:12], head_label[:12], 'ratio'))
+    regressions = []
+    for key in sorted(set(base) & set(head)):
+        before, after = base[key], head[key]
+        if math.isnan(before) or math.isnan(after) or before == 0:
+            ratio = float('nan')
+        else:
+            ratio = after / before
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print('{:<28} {:>6} {:>12.4f} {:>12.4f} {:>8.2f}{}'.format(key[0], key[1], before, after, ratio, flag))
+
+    for key in sorted(set(base) ^ set(head)):
+        print('{:<28} {:>6}  only in {}'.format(key[0], key[1], base_label if key in base else head_label))
+    return regressions
+
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark results files.')
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=1.10, help='slowdown ratio flagged as a regression')
+    args = parser.parse_args()
+    sys.exit(1 if compare(args.base, args.head, args.threshold) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import glob
+import hashlib
+import json
+import os
+import random
+from datetime import datetime, timedelta
+from email.utils import format_datetime
+from urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import escape
+import numpy as np
+from tagged_corpus import TaggedCorpus, UPOS_TAGS
+
+
+#a small fixed vocabulary the synthetic articles are written in, with a few words per POS tag
+WORDS = {'NOUN' : ['africa', 'market', 'government', 'election', 'drought', 'trade', 'river', 'city', 'farmer',
+                   'president', 'economy', 'border', 'water', 'school', 'health', 'energy', 'mine', 'port'],
+         'VERB' : ['say', 'grow', 'build', 'vote', 'open', 'close', 'report', 'plan', 'rise', 'fall'],
+         'ADJ' : ['new', 'large', 'local', 'dry', 'national', 'regional', 'economic', 'strong', 'poor', 'rich'],
+         'DET' : ['the', 'a', 'this'],
+         'ADP' : ['in', 'of', 'on', 'for']}
+
+
+
+
+class Fixtures:
+    '''
+    Responses the stand-in server replays: RSS feeds, article pages and relatedness scores.  They are
+    synthetic and seeded, so every run serves the same bytes, unless a directory of recorded responses is
+    given, in which case its feeds (rss/*.xml) and pages (articles/*.html) are served in turn instead, and
+    the scores of the pairs in its relatedness/*.json.  Those hold ConceptNet responses as saved from the
+    API, one per file or a list of them, each naming its pair in '@id'.  Pairs that weren't recorded get
+    a synthetic score.
+
+    Attributes:
+        items_per_day - how many articles a day of the synthetic feed holds
+        hosts - how many publishers the synthetic articles are spread over
+        paragraphs - how many paragraphs a synthetic article has
+        recorded_feeds, recorded_pages - the recorded responses, if a directory was given
+        recorded_scores - maps recorded pairs, as 'node1|node2' sorted, to their scores
+    '''
+
+    def __init__(self, items_per_day=20, hosts=20, paragraphs=8, recorded=None, seed=0):
+        self.items_per_day = items_per_day
+        self.hosts = hosts
+        self.paragraphs = paragraphs
+        self.seed = seed
+        self.recorded_feeds = sorted(glob.glob(os.path.join(recorded, 'rss', '*.xml'))) if recorded else []
+        self.recorded_pages = sorted(glob.glob(os.path.join(recorded, 'articles', '*.html'))) if recorded else []
+        self.recorded_scores = {}
+        for path in sorted(glob.glob(os.path.join(recorded, 'relatedness', '*.json'))) if recorded else []:
+            with open(path, encoding='utf-8') as fp:
+                responses = json.load(fp)
+            for response in responses if isinstance(responses, list) else [responses]:
+                query = parse_qs(urlparse(response['@id']).query)
+                self.recorded_scores[pair_key(query['node1'][0], query['node2'][0])] = response['value']
+
+
+    def feed(self, base_url, start_date, end_date, query_number=0):
+        '''
+        :return:
+            the RSS feed for [start_date, end_date), as bytes.  Like google news, it holds at most 100 items.
+        '''
+
+        if self.recorded_feeds:
+            with open(self.recorded_feeds[query_number % len(self.recorded_feeds)], 'rb') as fp:
+                return fp.read()
+
+        first = datetime.strptime(start_date, '%Y-%m-%d')
+        days = max(1, (datetime.strptime(end_date, '%Y-%m-%d') - first).days)
+        items = []
+        for d in range(days):
+            day = first + timedelta(days=d)
+            for i in range(self.items_per_day):
+                article_id = day.strftime('%Y%m%d') + '-' + str(i)
+                host = 'http://publisher' + str(i % self.hosts) + '.example'
+                items.append('<item><title>Article ' + article_id + '</title>'
+                             '<link>' + escape(base_url + '/article/' + article_id) + '</link>'
+                             '<pubDate>' + format_datetime(day.replace(hour=i % 24)) + ' +0000</pubDate>'
+                             '<source url="' + host + '">Publisher ' + str(i % self.hosts) + '</source></item>')
+
+        return ('<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>news</title>'
+                + ''.join(items[:100]) + '</channel></rss>').encode('utf-8')
+
+
+    def page(self, article_id, page_number=0):
+        '''
+        :return:
+            the HTML of an article, as bytes
+        '''
+
+        if self.recorded_pages:
+            with open(self.recorded_pages[page_number % len(self.recorded_pages)], 'rb') as fp:
+                return fp.read()
+
+        rng = random.Random(str(self.seed) + article_id)
+        body = ''.join('<p>' + ' '.join(sentence(rng) for _ in range(6)) + '</p>' for _ in range(self.paragraphs))
+        return ('<html><head><title>Article ' + article_id + '</title></head><body>'
+                '<article><h1>Article ' + article_id + '</h1>' + body + '</article></body></html>').encode('utf-8')
+
+
+    def relatedness(self, node1, node2):
+        '''
+        :return:
+            a score between -1 and 1 for a pair of concepts, the same whichever order they are given in
+        '''
+
+        pair = pair_key(node1, node2)
+        if pair in self.recorded_scores:
+            return self.recorded_scores[pair]
+        return int.from_bytes(hashlib.blake2b(pair.encode('utf-8'), digest_size=4).digest(), 'little') / 2 ** 31 - 1
+
+
+
+
+
+def pair_key(node1, node2):
+    '''
+    Helper function.  Relatedness is symmetric, so a pair is looked up with its concepts sorted.
+    '''
+    return '|'.join(sorted([node1, node2]))
+
+
+def sentence(rng):
+    '''
+    Helper function.  A random sentence of the synthetic vocabulary, always mentioning the keyword.
+    '''
+
+    words = [rng.choice(WORDS['DET']), rng.choice(WORDS['ADJ']), rng.choice(WORDS['NOUN']), rng.choice(WORDS['VERB']),
+             rng.choice(WORDS['ADP']), 'africa', rng.choice(WORDS['ADP']), rng.choice(WORDS['DET']),
+             rng.choice(WORDS['ADJ']), rng.choice(WORDS['NOUN'])]
+    return ' '.join(words).capitalize() + '.'
+
+
+
+
+
+def synthetic_tagged_corpus(n_documents, sentences_per_document=40, seed=0):
+    '''
+    Builds a TaggedCorpus of the synthetic vocabulary directly, without stanza, for timing the analysis
+    functions on their own.
+    '''
+
+    vocab = [w for tag in WORDS for w in WORDS[tag]]
+    tags = np.array([UPOS_TAGS.index(tag) for tag in WORDS for _ in WORDS[tag]], dtype=np.int8)
+    keyword = vocab.index('africa')
+
+    rng = np.random.RandomState(seed)
+    n_sentences = n_documents * sentences_per_document
+    lengths = rng.randint(6, 20, size=n_sentences)
+    lemma_ids = rng.randint(0, len(vocab), size=int(lengths.sum())).astype(np.int32)
+    sent_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    lemma_ids[sent_offsets[:-1] + 1] = keyword
+
+    return TaggedCorpus(vocab, lemma_ids, tags[lemma_ids],
+                        sent_offsets, np.arange(0, n_sentences + 1, sentences_per_document, dtype=np.int64),
+                        ['doc' + str(i) for i in range(n_documents)])
+
+
+
+
+
+def synthetic_terms(days, terms_per_day=8, seed=0):
+    '''
+    Per-day term lists in the form the related_from_* methods return, drawn from the synthetic vocabulary
+    so that they overlap from day to day as real ones do.
+    '''
+
+    rng = random.Random(seed)
+    vocab = [w for tag in ('NOUN', 'ADJ', 'VERB') for w in WORDS[tag]]
+    return [[(t, 1.0) for t in rng.sample(vocab, terms_per_day)] for _ in range(days)]
+
+
+
+
+
+def write_embeddings(path, languages=('en', 'fr'), dims=300, seed=0):
+    '''
+    Writes a random text embedding table covering the synthetic vocabulary in each language, in the
+    format EmbeddingBackend reads.
+    '''
+
+    rng = np.random.RandomState(seed)
+    terms = ['/c/' + language + '/' + w for language in languages for tag in WORDS for w in WORDS[tag]]
+    with open(path, 'w', encoding='utf-8') as fp:
+        fp.write(str(len(terms)) + ' ' + str(dims) + '\n')
+        for term in terms:
+            fp.write(term + ' ' + ' '.join('%.4f' % v for v in rng.randn(dims)) + '\n')
+    return path
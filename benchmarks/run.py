@@ -0,0 +1,206 @@
+'''
+Offline benchmarks of the pipeline stages.  Every request goes to a local stand-in server replaying
+synthetic (or recorded) feeds, article pages and relatedness scores, so nothing touches the network.
+Run from the repository root:
+
+    python -m benchmarks.run --sizes 10,50,200 --latency 0.02 --error-rate 0.05
+    python -m benchmarks.compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+Results are saved as benchmarks/results/<commit>.json, so that two commits can be compared.
+'''
+
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import g_news_corpus
+import relatedness
+import metrics
+import nlp_analysis as nlp
+import data_vis
+from article_cache import ArticleCache
+from benchmarks.fixtures import Fixtures, synthetic_tagged_corpus, synthetic_terms, write_embeddings
+from benchmarks.server import StandInServer
+
+
+METHODS = ('frequency', 'word2vec', 'FastText')
+
+
+
+
+def git_label():
+    '''
+    Helper function.  Names the results after the commit they were measured at, marked if the tree had changes.
+    '''
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + ('-dirty' if dirty else '')
+
+
+
+
+
+def timed(func, repeat=1, setup=None):
+    '''
+    Helper function.  Runs func repeat times and keeps the fastest run.  setup, if given, is called before
+    each run, untimed, and its return value is passed to func.
+
+    :return:
+        a (seconds, result of the fastest run) tuple
+    '''
+
+    best, result = math.inf, None
+    for _ in range(repeat):
+        args = (setup(),) if setup is not None else ()
+        start = time.perf_counter()
+        out = func(*args)
+        elapsed = time.perf_counter() - start
+        if elapsed < best:
+            best, result = elapsed, out
+    return best, result
+
+
+
+
+
+def run(sizes=(10, 50, 200), latency=0.0, jitter=0.0, error_rate=0.0, items_per_day=20, recorded=None,
+        repeat=1, workers=8, out_dir='benchmarks/results', label=None):
+    '''
+    Times every stage at each corpus size, against a fresh stand-in server.
+
+    :param
+        sizes - the corpus sizes, in articles
+        latency, jitter, error_rate - see StandInServer
+        items_per_day - how many articles a day of the synthetic feed holds
+        recorded - directory of recorded responses to replay instead of synthetic ones, see Fixtures
+        repeat - how many times each stage is run.  The fastest run is kept.
+        workers - download threads for build_corpus
+        out_dir - where the results file goes
+        label - names the results file.  Defaults to the current commit.
+
+    :return:
+        the path of the results file
+    '''
+
+    work = tempfile.mkdtemp(prefix='nlp-bench-')
+    server = StandInServer(Fixtures(items_per_day=items_per_day, recorded=recorded),
+                           latency=latency, jitter=jitter, error_rate=error_rate).start()
+    saved_urls = g_news_corpus.GOOGLE_NEWS_RSS, relatedness.CONCEPTNET_API
+    g_news_corpus.GOOGLE_NEWS_RSS = server.url + '/rss/search'
+    relatedness.CONCEPTNET_API = server.url + '/relatedness'
+    metrics.metrics.reset()
+
+    results = []
+    def record(stage, size, seconds, **extra):
+        results.append(dict(stage=stage, size=size, seconds=seconds, **extra))
+        print('{:<28} {:>6} {:>10.4f} s  {}'.format(stage, size, seconds, extra or ''))
+
+    def needs_models(stage, size, func, **extra):
+        '''
+        Times a stage that needs stanza models or nltk data, recording it as skipped if they aren't installed.
+        '''
+        try:
+            seconds, out = timed(func, repeat)
+        except (LookupError, OSError) as e:
+            reason = next((line.strip() for line in str(e).splitlines() if any(c.isalnum() for c in line)), '')
+            record(stage, size, float('nan'), skipped=type(e).__name__ + ': ' + reason[:100])
+            return None
+        record(stage, size, seconds, **extra)
+        return out
+
+    try:
+        embeddings = relatedness.EmbeddingBackend(write_embeddings(os.path.join(work, 'embeddings.txt')))
+        for size in sizes:
+            days = max(1, math.ceil(size / items_per_day))
+            end = time.strftime('%Y-%m-%d', time.gmtime(time.mktime((2022, 1, 1 + days, 12, 0, 0, 0, 0, -1))))
+
+            seconds, meta = timed(lambda: g_news_corpus.get_news_meta_data('africa', '2022-01-01', end, 'en'), repeat)
+            record('get_news_meta_data', size, seconds, items=len(meta))
+            meta = meta[:size]
+
+            fresh_cache = lambda: ArticleCache(tempfile.mkdtemp(dir=work))
+            seconds, texts = timed(lambda cache: nlp.build_corpus(meta, show_progress=False, cache=cache, workers=workers,
+                                                                 per_host=4, host_delay=0),
+                                   repeat, fresh_cache)
+            record('build_corpus', size, seconds, articles=len(texts))
+
+            #the pipeline is built here without downloading, so missing models skip the stage rather than reach the network
+            needs_models('run_stanza_pipeline', size, lambda: (nlp.get_pipeline('en', download_method=None),
+                                                               nlp.run_stanza_pipeline(texts, 'en', batch_size=32, compact=True)),
+                         articles=len(texts))
+
+            #the analysis is timed on a synthetic tagged corpus, so it doesn't depend on stanza models
+            tagged = synthetic_tagged_corpus(size)
+            needs_models('related_from_most_frequent', size, lambda: nlp.related_from_most_frequent(tagged), words=tagged.n_words)
+            prepared = needs_models('prepare_training_corpus', size, lambda: nlp.prepare_training_corpus(tagged), words=tagged.n_words)
+            if prepared is not None:
+                try:
+                    needs_models('related_from_word2vec', size, lambda: nlp.related_from_word2vec('africa', prepared), words=tagged.n_words)
+                    needs_models('related_from_fasttext', size, lambda: nlp.related_from_fasttext('africa', prepared), words=tagged.n_words)
+                finally:
+                    os.remove(prepared.path)
+
+            score_days = max(1, size // 10)
+            en = {m : synthetic_terms(score_days, seed=2 * i) for i, m in enumerate(METHODS)}
+            fr = {m : synthetic_terms(score_days, seed=2 * i + 1) for i, m in enumerate(METHODS)}
+            fresh_client = lambda: relatedness.ConceptNetClient(relatedness.RelatednessCache(os.path.join(tempfile.mkdtemp(dir=work), 'r.sqlite')),
+                                                                rate=1e6, burst=1e6)
+            for name, backend in (('conceptnet', fresh_client), ('embedding', lambda: embeddings)):
+                seconds, _ = timed(lambda client: [data_vis.get_similarity_score_between_languages('en', 'fr', en[m][d], fr[m][d], client)
+                                                   for m in METHODS for d in range(score_days)],
+                                   repeat, backend)
+                record('score_per_day.' + name, size, seconds, days=score_days)
+                seconds, _ = timed(lambda client: relatedness.daily_scores('en', 'fr', en, fr, client), repeat, backend)
+                record('daily_scores.' + name, size, seconds, days=score_days)
+    finally:
+        g_news_corpus.GOOGLE_NEWS_RSS, relatedness.CONCEPTNET_API = saved_urls
+        server.stop()
+        shutil.rmtree(work, ignore_errors=True)
+
+    label = label or git_label()
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, label + '.json')
+    with open(path, 'w', encoding='utf-8') as fp:
+        json.dump({'label' : label, 'time' : time.strftime('%Y-%m-%dT%H:%M:%S'), 'python' : platform.python_version(),
+                   'machine' : platform.machine(), 'cpus' : os.cpu_count(),
+                   'params' : {'sizes' : list(sizes), 'latency' : latency, 'jitter' : jitter, 'error_rate' : error_rate,
+                               'items_per_day' : items_per_day, 'recorded' : recorded, 'repeat' : repeat, 'workers' : workers},
+                   'requests' : server.requests, 'results' : results, 'metrics' : metrics.metrics.snapshot()},
+                  fp, indent=1)
+    print('Saved results to ' + path)
+    return path
+
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the pipeline stages against a local stand-in server.')
+    parser.add_argument('--sizes', default='10,50,200', help='corpus sizes in articles, comma separated')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many more seconds, at random')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of article and relatedness requests that fail')
+    parser.add_argument('--items-per-day', type=int, default=20)
+    parser.add_argument('--recorded', help='directory of recorded rss/*.xml, articles/*.html and relatedness/*.json to replay')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per stage, the fastest is kept')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--out', default='benchmarks/results')
+    parser.add_argument('--label', help='results file name, defaults to the current commit')
+    args = parser.parse_args()
+
+    run([int(s) for s in args.sizes.split(',')], args.latency, args.jitter, args.error_rate, args.items_per_day,
+        args.recorded, args.repeat, args.workers, args.out, args.label)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from benchmarks.fixtures import Fixtures
+
+
+
+
+class StandInServer:
+    '''
+    Local HTTP server standing in for google news RSS, the publishers' article pages and the ConceptNet
+    relatedness API, so that the pipeline can be timed without the network.  Runs on a background thread.
+
+        /rss/search?q=keyword after:yyyy-mm-dd before:yyyy-mm-dd    the RSS feed of that date range
+        /article/<id>                                               an article page
+        /relatedness?node1=...&node2=...                            {"value" : score}
+
+    Attributes:
+        fixtures - the Fixtures the responses come from
+        latency - seconds every response is held back by
+        jitter - up to this many more seconds are added at random
+        error_rate - the fraction of requests answered with a 503 instead
+        error_paths - the path prefixes errors are injected on.  RSS is left out by default, as a failed
+                      feed query fails the whole scrape rather than one article.
+        requests - how many requests have been served, by path prefix
+
+    :param
+        port - 0 picks a free port, see url
+    '''
+
+    def __init__(self, fixtures=None, latency=0.0, jitter=0.0, error_rate=0.0, error_paths=('/article/', '/relatedness'),
+                 port=0, seed=0):
+        self.fixtures = fixtures if fixtures is not None else Fixtures()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_paths = tuple(error_paths)
+        self.random = random.Random(seed)
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler(self))
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:' + str(self.httpd.server_address[1])
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+    def count(self, prefix):
+        '''
+        Counts a request, and returns how many there had been before it under the same prefix.
+        '''
+
+        with self.lock:
+            n = self.requests.get(prefix, 0)
+            self.requests[prefix] = n + 1
+            return n
+
+
+    def respond(self, path, query):
+        '''
+        :return:
+            a (status, content type, body) tuple for a request
+        '''
+
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            failed = self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if failed and path.startswith(self.error_paths):
+            return 503, 'text/plain', b'injected error'
+
+        if path == '/rss/search':
+            q = query.get('q', [''])[0]
+            after = re.search(r'after:(\d{4}-\d\d-\d\d)', q)
+            before = re.search(r'before:(\d{4}-\d\d-\d\d)', q)
+            if not (after and before):
+                return 400, 'text/plain', b'expected after: and before: in q'
+            return 200, 'application/rss+xml', self.fixtures.feed(self.url, after.group(1), before.group(1), self.count('rss'))
+
+        if path.startswith('/article/'):
+            return 200, 'text/html; charset=utf-8', self.fixtures.page(path[len('/article/'):], self.count('article'))
+
+        if path == '/relatedness':
+            self.count('relatedness')
+            value = self.fixtures.relatedness(query.get('node1', [''])[0], query.get('node2', [''])[0])
+            return 200, 'application/json', json.dumps({'value' : value}).encode('utf-8')
+
+        return 404, 'text/plain', b'not found'
+
+
+
+
+
+def handler(server):
+    '''
+    Helper function.  Builds the request handler class bound to a StandInServer.
+    '''
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        #headers and body go out in separate writes, which Nagle's algorithm would hold back on keep-alive connections
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            status, content_type, body = server.respond(url.path, parse_qs(url.query))
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
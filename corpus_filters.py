@@ -0,0 +1,126 @@
+from functools import lru_cache
+import re
+
+
+#nltk's names for the stopword lists of the languages we scrape
+stopword_languages = {'en' : 'english', 'fr' : 'french', 'de' : 'german', 'es' : 'spanish', 'it' : 'italian'}
+
+#phrases that give away a page that isn't the article: paywalls, consent walls, bot checks, dead links
+boilerplate_patterns = re.compile('|'.join([
+    r'subscribe (now )?to (continue|keep) reading',
+    r'(already|become) a (subscriber|member)',
+    r'this (article|content) is (only )?(available|reserved) (to|for) (subscribers|members)',
+    r'you have reached (your|the) (limit|maximum) of (free )?articles',
+    r'please enable (javascript|cookies)',
+    r'(we use|this (site|website) uses) cookies',
+    r'(are you a robot|verify (that )?you are (a )?human)',
+    r'(page|article) (not found|no longer available|has been removed)',
+    r'abonnez-vous pour (lire|continuer)',
+    r'cet article est r[ée]serv[ée] aux abonn[ée]s',
+    r'jetzt (abonnieren|weiterlesen)',
+]), re.IGNORECASE)
+
+
+
+
+def article_text(article):
+    '''
+    Helper function.  Filters accept plain article strings, or records with the text under 'text'.
+    '''
+    return article['text'] if isinstance(article, dict) else article
+
+
+
+
+
+def min_length(articles, min_chars=500):
+    '''
+    Drops articles shorter than min_chars characters, which are usually captions or failed extractions.
+    '''
+
+    for article in articles:
+        if len(article_text(article)) >= min_chars:
+            yield article
+
+
+
+
+
+@lru_cache(maxsize=None)
+def _stopwords(language):
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words(stopword_languages[language]))
+
+
+def detect_language(text, sample_words=300, min_hits=10):
+    '''
+    Fast language identification by stopword counting.  Counts how many of the first sample_words words of
+    the text are stopwords in each language we scrape, and picks the language with the most.
+
+    :return:
+        a language code from stopword_languages, or None if no language reaches min_hits
+    '''
+
+    words = re.findall(r'\w+', text[:sample_words * 12].lower())[:sample_words]
+    hits = {language : sum(1 for w in words if w in _stopwords(language)) for language in stopword_languages}
+    best = max(hits, key=hits.get)
+    return best if hits[best] >= min_hits else None
+
+
+def language_filter(articles, language):
+    '''
+    Drops articles that are detectably in another language than 'language'.  Articles whose language
+    can't be told apart are kept, and everything is kept for languages without a stopword list.
+    '''
+
+    for article in articles:
+        if language not in stopword_languages:
+            yield article
+            continue
+        detected = detect_language(article_text(article))
+        if detected is None or detected == language:
+            yield article
+
+
+
+
+
+def boilerplate_filter(articles, max_stub_chars=2000, max_repeated_lines=0.5):
+    '''
+    Drops paywall, cookie-wall and error-page stubs: short articles that contain one of the
+    boilerplate_patterns, and articles where most lines are repeats (navigation and link lists).
+    '''
+
+    for article in articles:
+        text = article_text(article)
+        if len(text) <= max_stub_chars and boilerplate_patterns.search(text):
+            continue
+
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        if len(lines) >= 10 and 1 - len(set(lines)) / len(lines) > max_repeated_lines:
+            continue
+        yield article
+
+
+
+
+
+def filter_articles(articles, language=None, min_chars=500):
+    '''
+    Chains the filters into one lazy pipeline.  Nothing is read from 'articles' until the result is
+    iterated, so articles can be filtered one at a time as the scraper produces them.
+
+    :param
+        articles - any iterable of article strings (or records with a 'text' key)
+        language - the language the articles should be in.  None skips the language check.
+        min_chars - see min_length
+
+    :return:
+        a generator of the articles that pass every filter, in order
+    '''
+
+    articles = min_length(articles, min_chars)
+    articles = boilerplate_filter(articles)
+    if language is not None:
+        articles = language_filter(articles, language)
+    return articles
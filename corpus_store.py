@@ -0,0 +1,176 @@
+import glob
+import json
+import os
+import zlib
+from datetime import datetime
+
+
+#fields kept for every article, besides its text
+record_fields = ('title', 'pubdate', 'link', 'source', 'language', 'keyword')
+
+
+
+
+class CorpusStore:
+    '''
+    Saved corpora, as compressed line-delimited JSON shards: one shard per keyword, language and date window,
+    at root/keyword/language/start_end.jsonl.gz.  Each article is one JSON record, with its text and
+    metadata, compressed as its own gzip member.  Concatenated members are still a valid gzip file, so a
+    shard can be streamed with gzip.open, and a sidecar index (.idx, one JSON line per record) holds each
+    record's byte offset and length, so a single article can be read by seeking straight to it.
+
+    Attributes:
+        root - the directory the shards are kept under
+    '''
+
+    def __init__(self, root='articles'):
+        self.root = root
+
+
+    def shard_path(self, keyword, language, start, end):
+        return os.path.join(self.root, keyword, language, start + '_' + end + '.jsonl.gz')
+
+
+    def write_shard(self, articles, keyword, language, start, end):
+        '''
+        Writes one window's articles as a shard, replacing any earlier shard of the same window.
+
+        :param
+            articles - article records (dicts with 'text' and any of record_fields), or plain strings
+            keyword, language, start, end - what the shard holds
+
+        :return:
+            the path of the shard
+        '''
+
+        path = self.shard_path(keyword, language, start, end)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        offset = 0
+        with open(path + '.tmp', 'wb') as data, open(path + '.idx.tmp', 'w', encoding='utf-8') as index:
+            for article in articles:
+                record = to_record(article, keyword, language)
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+                member = compressor.compress((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')) + compressor.flush()
+                data.write(member)
+                index.write(json.dumps({'offset' : offset, 'length' : len(member), 'pubdate' : record['pubdate'],
+                                        'link' : record['link']}) + '\n')
+                offset += len(member)
+
+        os.replace(path + '.tmp', path)
+        os.replace(path + '.idx.tmp', path + '.idx')
+        return path
+
+
+    def remove_shard(self, path):
+        for filename in (path, path + '.idx'):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+
+    def shards(self, keyword='*', language='*', start=None, end=None):
+        '''
+        :return:
+            the paths of the shards of a keyword and language (both may be '*') whose window overlaps
+            [start, end), sorted by window
+        '''
+
+        paths = []
+        for path in glob.glob(os.path.join(self.root, keyword, language, '*.jsonl.gz')):
+            window_start, window_end = os.path.basename(path)[:-len('.jsonl.gz')].split('_')
+            if (end is None or window_start < end) and (start is None or window_end > start):
+                paths.append(path)
+        return sorted(paths, key=os.path.basename)
+
+
+    def index(self, path):
+        with open(path + '.idx', encoding='utf-8') as fp:
+            return [json.loads(line) for line in fp]
+
+
+    def read(self, path, offset, length):
+        '''
+        Reads the single record stored at offset, without touching the rest of the shard.
+        '''
+
+        with open(path, 'rb') as fp:
+            fp.seek(offset)
+            return json.loads(zlib.decompress(fp.read(length), 31))
+
+
+    def get(self, path, i):
+        entry = self.index(path)[i]
+        return self.read(path, entry['offset'], entry['length'])
+
+
+    def records(self, path):
+        '''
+        Streams every record of one shard, in the order they were written.
+        '''
+
+        with open(path, 'rb') as fp:
+            for entry in self.index(path):
+                fp.seek(entry['offset'])
+                yield json.loads(zlib.decompress(fp.read(entry['length']), 31))
+
+
+    def iter_records(self, keyword='*', language='*', start=None, end=None):
+        '''
+        Streams the records of every matching shard, one at a time.  With start or end, only articles
+        published in [start, end) are read: the index is checked first, and other records are skipped
+        without being decompressed.  Articles without a pubdate are always included.
+        '''
+
+        for path in self.shards(keyword, language, start, end):
+            with open(path, 'rb') as fp:
+                for entry in self.index(path):
+                    day = (entry['pubdate'] or '')[:10]
+                    if day and ((start is not None and day < start) or (end is not None and day >= end)):
+                        continue
+                    fp.seek(entry['offset'])
+                    yield json.loads(zlib.decompress(fp.read(entry['length']), 31))
+
+
+    def texts(self, keyword='*', language='*', start=None, end=None):
+        for record in self.iter_records(keyword, language, start, end):
+            yield record['text']
+
+
+
+
+
+def to_record(article, keyword=None, language=None):
+    '''
+    Helper function.  Turns an article string, or a record as returned by create_articles_from_keyphrase
+    with with_meta, into a JSON-ready record.
+    '''
+
+    if not isinstance(article, dict):
+        article = {'text' : article}
+    record = {field : article.get(field) for field in record_fields}
+    record['text'] = article['text']
+    record['keyword'] = record['keyword'] or keyword
+    record['language'] = record['language'] or language
+    if isinstance(record['pubdate'], datetime):
+        record['pubdate'] = record['pubdate'].isoformat()
+    return record
+
+
+
+
+
+def load_corpus(keyword, language, start=None, end=None, root='articles'):
+    '''
+    Loads saved articles as the list of strings run_stanza_pipeline takes.
+
+    :param
+        keyword - the keyword the articles were collected for
+        language - their language
+        start, end - only articles published in [start, end), yyyy-mm-dd.  None means unbounded.
+        root - the CorpusStore directory
+
+    :return:
+        a list of article strings
+    '''
+
+    return list(CorpusStore(root).texts(keyword, language, start, end))
@@ -1,7 +1,11 @@
-import requests
+from datetime import datetime, timedelta
+from functools import partial
+import os
+import threading
 import matplotlib.pyplot as plt
-import time
 import nlp_analysis as nlp
+import relatedness
+from experiment import Experiment
 
 
 def tuples_to_lists(terms):
@@ -14,21 +18,31 @@ def tuples_to_lists(terms):
 
 
 
-def get_similarity_score_between_languages(l1, l2, l1_terms, l2_terms):
-    sim_score = 0
+def get_similarity_score_between_languages(l1, l2, l1_terms, l2_terms, client=None):
+    '''
+    Sums the relatedness of every pair of terms between two lists in two languages.
 
-    if type(l1_terms[0]) == 'tuple':
+    :param
+        l1 - language code of l1_terms
+        l2 - language code of l2_terms
+        l1_terms - list of terms, or of (term, score) tuples as returned by the gensim methods
+        l2_terms - same, in l2
+        client - where relatedness comes from, a ConceptNetClient or EmbeddingBackend.  Defaults to
+                 relatedness.default_backend, the shared, cached ConceptNet client unless replaced.
+
+    :return:
+        the summed relatedness score
+    '''
+    if client is None:
+        client = relatedness.default_backend
+
+    if type(l1_terms[0]) is tuple:
         l1_terms = tuples_to_lists(l1_terms)
-    if type(l2_terms[0]) == 'tuple':
+    if type(l2_terms[0]) is tuple:
         l2_terms = tuples_to_lists(l2_terms)
 
-    for t_l1 in l1_terms:
-        for t_l2 in l2_terms:
-            query = 'http://api.conceptnet.io/relatedness?node1=/c/' + l1 + '/'+ t_l1 + '&node2=/c/' + l2 + '/' + t_l2
-            
-            obj = requests.get(query).json()
-            sim_score += obj['value']
-            time.sleep(2)
+    scores = client.score_matrix(l1, l1_terms, l2, l2_terms)
+    sim_score = float(sum(sum(row) for row in scores))
 
     return sim_score
 
@@ -38,24 +52,9 @@ def get_similarity_score_between_languages(l1, l2, l1_terms, l2_terms):
 
 
 
-def get_similarity_score_between_methods(method1_terms, method2_terms, language='en'):
+def get_similarity_score_between_methods(method1_terms, method2_terms, language='en', client=None):
 
-    if type(method1_terms[0]) is tuple:
-        method1_terms = tuples_to_lists(method1_terms)
-    if type(method2_terms[0]) is tuple:
-        method2_terms = tuples_to_lists(method2_terms)
-
-    sim_score = 0
-    returned_values = 0
-    for t_l1 in method1_terms:
-        for t_l2 in method2_terms:
-            query = 'http://api.conceptnet.io/relatedness?node1=/c/' + language + '/'+ t_l1 + '&node2=/c/' + language + '/' + t_l2
-            
-            obj = requests.get(query).json()
-            sim_score += obj['value']
-            time.sleep(2)
-
-    return sim_score
+    return get_similarity_score_between_languages(language, language, method1_terms, method2_terms, client)
 
 
 def visualize_drift(freq_sim, fastt_sim, word2vec_sim, dates):
@@ -74,56 +73,68 @@ def visualize_drift(freq_sim, fastt_sim, word2vec_sim, dates):
 
 
 
-def demonstrate_all(start='2022-08-15'):
-    arts_en, arts_fr = nlp.generate_test_corpora(start)
-
-    en_data = {'frequency' : [],
-                'word2vec' : [],
-                'FastText' : []}
-    fr_data = {'frequency' : [],
-                'word2vec' : [],
-                'FastText' : []}
-    
-    for arts in arts_en:
-        pipe = nlp.run_stanza_pipeline(arts)
-        en_data['frequency'].append(nlp.related_from_most_frequent(pipe))
-        en_data['word2vec'].append(nlp.related_from_word2vec('africa', pipe))
-        en_data['FastText'].append(nlp.related_from_fasttext('africa', pipe))
-
-    for arts in arts_fr:
-        pipe = nlp.run_stanza_pipeline(arts, language='fr')
-        fr_data['frequency'].append(nlp.related_from_most_frequent(pipe, language='fr'))
-        fr_data['word2vec'].append(nlp.related_from_word2vec('afrique', pipe, language='fr'))
-        fr_data['FastText'].append(nlp.related_from_fasttext('afrique', pipe, language='fr'))
-
-
-
-
-    #Gets the sim scores between English and French languages
-    freq_sim = []
-    for i in range(len(en_data['frequency'])):
-        en = en_data['frequency'][i]
-        fr = fr_data['frequency'][i]
-        sim_score = get_similarity_score_between_languages('en', 'fr', en, fr)
-        freq_sim.append(sim_score)
-        print('Calculating Frequency relatedness...')
-
-        
-    word2vec_sim = []
-    for i in range(len(en_data['word2vec'])):
-        en = tuples_to_lists(en_data['word2vec'][i])
-        fr = tuples_to_lists(fr_data['word2vec'][i])
-        sim_score = get_similarity_score_between_languages('en', 'fr', en, fr)
-        word2vec_sim.append(sim_score)
-        print('Calculating word2vec relatedness...')
-        
-    fastt_sim = []
-    for i in range(len(en_data['FastText'])):
-        en = tuples_to_lists(en_data['FastText'][i])
-        fr = tuples_to_lists(fr_data['FastText'][i])
-        sim_score = get_similarity_score_between_languages('en', 'fr', en, fr)
-        fastt_sim.append(sim_score)
-        print('Calculating FastText relatedness...')
+def demonstrate_all(start='2022-08-15', days=10, word2vec_window=5, fasttext_window=4, workers=4, force=()):
+    '''
+    Scrapes a day-by-day corpus in English and French, finds the terms related to 'africa' and 'afrique'
+    each day by three methods, and scores how related the two languages' terms are.
+
+    The steps are stages of an Experiment (corpus, tagged, prepared, related and score), each keyed by its
+    inputs and cached under cache/experiments, so a second call only runs what changed.  Changing
+    fasttext_window re-trains FastText and re-scores, without re-scraping or re-tagging anything.  Each
+    day's corpus is tokenized once, into a file under cache/prepared that word2vec and FastText both train
+    from.  Days and languages run
+    in parallel, and an exception loses none of the stages that had finished.
+
+    :param
+        start - the first day, yyyy-mm-dd
+        days - how many days to cover
+        word2vec_window, fasttext_window - the window of each model
+        workers - how many stages run at once
+        force - stage names to re-run even if cached, e.g. ('corpus',) to re-scrape
+
+    :return:
+        the English and French related terms, as dicts from method to a list with each day's terms, and the
+        frequency, FastText and word2vec relatedness scores of each day
+    '''
+
+    keywords = {'en' : 'africa', 'fr' : 'afrique'}
+    first = datetime.strptime(start, "%Y-%m-%d")
+    windows = [((first + timedelta(days=i)).strftime("%Y-%m-%d"), (first + timedelta(days=i + 1)).strftime("%Y-%m-%d"))
+               for i in range(days)]
+
+    #the scrapes run side by side, so they share one download budget and one set of per-host limits, as in collect_languages
+    scrape = partial(nlp.create_articles_from_keyphrase, show_progress=False,
+                     budget=threading.Semaphore(16), limiter=nlp.HostLimiter())
+    #stanza already uses every core, so days are tagged one at a time
+    exp = Experiment(workers=workers, limits={'tagged' : 1})
+
+    related = {}
+    for language, keyword in keywords.items():
+        related[language] = {'frequency' : [], 'word2vec' : [], 'FastText' : []}
+        for day, next_day in windows:
+            window = {'keyword' : keyword, 'language' : language, 'start_date' : day, 'end_date' : next_day}
+            corpus = exp.add('corpus', scrape, params=window)
+            tagged = exp.add('tagged', nlp.tag_corpus, {'articles' : corpus}, dict(window, batch_size=32), cache=False)
+            #the file is rewritten whenever a model has to be trained, so it isn't worth caching the PreparedCorpus
+            prepared = exp.add('prepared', nlp.prepare_training_corpus, {'corpus' : tagged},
+                               {'language' : language, 'path' : os.path.join('cache', 'prepared', tagged.key + '.txt')}, cache=False)
+            related[language]['frequency'].append(exp.add('related', nlp.related_from_most_frequent, {'tagged_corpus' : tagged},
+                                                          {'language' : language}))
+            related[language]['word2vec'].append(exp.add('related', nlp.related_from_word2vec, {'corpus' : prepared},
+                                                         {'keyword' : keyword, 'language' : language, 'window' : word2vec_window}))
+            related[language]['FastText'].append(exp.add('related', nlp.related_from_fasttext, {'corpus' : prepared},
+                                                         {'keyword' : keyword, 'language' : language, 'window' : fasttext_window}))
+
+    #Gets the sim scores between English and French languages, every method and day in one batch
+    score = exp.add('score', relatedness.daily_scores, {'l1_terms' : related['en'], 'l2_terms' : related['fr']},
+                    {'l1' : 'en', 'l2' : 'fr'})
+    results = exp.run({'en' : related['en'], 'fr' : related['fr'], 'score' : score}, force)
+
+    en_data = results['en']
+    fr_data = results['fr']
+    freq_sim = results['score']['frequency']
+    word2vec_sim = results['score']['word2vec']
+    fastt_sim = results['score']['FastText']
 
     dates = ['Aug 14', 'Aug 15', 'Aug 16', 'Aug 17', 'Aug 18', 'Aug 19', 'Aug 20', 'Aug 21']
 
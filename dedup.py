@@ -0,0 +1,142 @@
+import hashlib
+import re
+import numpy as np
+from corpus_filters import article_text
+
+
+#minhash permutations are (a * x + b) mod PRIME over 32-bit shingle hashes, which keeps every
+#product inside 64 bits.
+PRIME = (1 << 31) - 1
+
+
+
+
+def shingles(text, size=5):
+    '''
+    Helper function.  Hashes every run of 'size' consecutive words in a text.
+
+    :return:
+        a numpy uint64 array of the distinct 32-bit shingle hashes
+    '''
+
+    words = re.findall(r'\w+', text.lower())
+    grams = {' '.join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+    return np.array([int.from_bytes(hashlib.blake2b(g.encode('utf-8'), digest_size=4).digest(), 'little')
+                     for g in grams], dtype=np.uint64)
+
+
+
+
+
+def minhash_signatures(texts, num_perm=128, shingle_size=5, seed=1):
+    '''
+    Computes a MinHash signature for each text.  The fraction of positions where two signatures agree
+    estimates the Jaccard similarity of the texts' shingle sets.
+
+    :return:
+        a (len(texts) x num_perm) uint32 array
+    '''
+
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, PRIME, size=num_perm).astype(np.uint64)[:, None]
+    b = rng.randint(0, PRIME, size=num_perm).astype(np.uint64)[:, None]
+
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for i, text in enumerate(texts):
+        hashes = shingles(text, shingle_size)
+        signatures[i] = ((a * hashes[None, :] + b) % PRIME).min(axis=1)
+    return signatures
+
+
+
+
+
+def choose_bands(threshold, num_perm):
+    '''
+    Helper function.  Picks the number of LSH bands, and rows per band, for a similarity threshold.  Pairs
+    at similarity s become candidates with probability 1 - (1 - s^rows)^bands, which rises steeply around
+    (1 / bands)^(1 / rows).  That point is put just under the threshold, so that few true duplicates are missed.
+
+    :return:
+        a (bands, rows) tuple, with bands * rows == num_perm
+    '''
+
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [(b, r) for b, r in options if (1 / b) ** (1 / r) <= threshold]
+    return max(below, key=lambda o: (1 / o[0]) ** (1 / o[1])) if below else options[0]
+
+
+
+
+
+def find_near_duplicates(texts, threshold=0.8, num_perm=128, shingle_size=5):
+    '''
+    Groups texts whose estimated Jaccard similarity is at least threshold.  Each text is hashed into one
+    bucket per LSH band, and only texts sharing a bucket are compared, so the work grows about linearly
+    with the number of texts.
+
+    Attributes:
+        signatures - the MinHash signature of each text
+        parent - union-find forest over the texts.  Texts with the same root are duplicates.
+
+    :param
+        texts - list of strings
+        threshold - the smallest similarity, between 0 and 1, at which two texts count as duplicates
+        num_perm - signature length.  Longer is more accurate and slower.
+        shingle_size - the number of words in a shingle
+
+    :return:
+        a list holding, for each text, the index of the first text of its group
+    '''
+
+    signatures = minhash_signatures(texts, num_perm, shingle_size)
+    bands, rows = choose_bands(threshold, num_perm)
+
+    parent = list(range(len(texts)))
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(bands):
+        buckets = {}
+        for i, key in enumerate(map(bytes, signatures[:, band * rows:(band + 1) * rows])):
+            members = buckets.setdefault(key, [])
+            for j in members:
+                if root(i) == root(j):
+                    break
+                if np.mean(signatures[i] == signatures[j]) >= threshold:
+                    parent[max(root(i), root(j))] = min(root(i), root(j))
+                    break
+            members.append(i)
+
+    return [root(i) for i in range(len(texts))]
+
+
+
+
+
+def remove_near_duplicates(articles, threshold=0.8, num_perm=128, shingle_size=5):
+    '''
+    Collapses each group of near-duplicate articles, such as one wire story syndicated under many URLs,
+    into its longest copy.
+
+    :param
+        articles - list of article strings, or of records with the text under 'text'
+        threshold, num_perm, shingle_size - see find_near_duplicates
+
+    :return:
+        the articles with duplicates removed, in their original order
+    '''
+
+    texts = [article_text(a) for a in articles]
+    groups = find_near_duplicates(texts, threshold, num_perm, shingle_size)
+
+    longest = {}
+    for i, group in enumerate(groups):
+        if group not in longest or len(texts[i]) > len(texts[longest[group]]):
+            longest[group] = i
+    keep = sorted(longest.values())
+
+    return [articles[i] for i in keep]
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import pickle
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+
+
+class Node:
+    '''
+    One stage of an Experiment: a function, the nodes whose results it takes, and its parameters.
+
+    Attributes:
+        name - the stage, e.g. 'corpus' or 'related'.  Results are cached per stage.
+        func - called as func(**inputs, **params), with each input node replaced by its result
+        inputs - maps argument names to nodes, or to lists or dicts of nodes
+        params - the other arguments.  Must be JSON-serializable, as they are part of the key.
+        cache - whether the result is pickled to disk.  Turn off for stages that keep their own
+                store (such as tag_corpus) or that are cheaper to redo than to load.
+        key - hash of the name, function, params and input keys, so a node's key changes whenever
+              anything upstream of it does
+    '''
+
+    def __init__(self, name, func, inputs=None, params=None, cache=True):
+        self.name = name
+        self.func = func
+        self.inputs = inputs or {}
+        self.params = params or {}
+        self.cache = cache
+        self.deps = list(nodes_in(self.inputs))
+
+        description = {'name' : name, 'func' : func_name(func), 'params' : self.params,
+                       'inputs' : resolve(self.inputs, lambda node: node.key)}
+        self.key = hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:20]
+
+
+    def __repr__(self):
+        return 'Node(' + self.name + ', ' + json.dumps(self.params, sort_keys=True, default=str) + ')'
+
+
+
+
+
+def func_name(func):
+    '''
+    Helper function.  The qualified name of a function, looking through functools.partial.
+    '''
+
+    while isinstance(func, partial):
+        func = func.func
+    return getattr(func, '__module__', '') + '.' + getattr(func, '__qualname__', repr(func))
+
+
+def nodes_in(value):
+    '''
+    Helper function.  Yields the nodes in an input: a node, or a list, tuple or dict holding nodes.
+    '''
+
+    if isinstance(value, Node):
+        yield value
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from nodes_in(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from nodes_in(v)
+
+
+def resolve(value, lookup):
+    '''
+    Helper function.  Replaces every node in an input with lookup(node), keeping the structure.
+    '''
+
+    if isinstance(value, Node):
+        return lookup(value)
+    if isinstance(value, dict):
+        return {k : resolve(v, lookup) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [resolve(v, lookup) for v in value]
+    return value
+
+
+
+
+
+class Experiment:
+    '''
+    Runs a graph of stages, caching each result on disk under its key.  A node whose key is already
+    cached is loaded rather than run, and the nodes upstream of it aren't touched at all, so changing
+    one parameter only re-runs the nodes that depend on it.  Nodes that don't depend on each other run
+    in parallel.  If a node fails, everything that finished is already cached, and the next run picks
+    up from there.
+
+    Objects that shouldn't be part of the key, such as a shared HostLimiter, can be bound to func with
+    functools.partial.
+
+    Attributes:
+        cache_dir - results are pickled to cache_dir/stage/key.pkl
+        workers - how many nodes run at once
+        limits - maps stage names to the most nodes of that stage that may run at once, e.g. {'tagged' : 1}
+
+    Example:
+        exp = Experiment()
+        corpus = exp.add('corpus', create_articles_from_keyphrase, params={'keyword' : 'africa', ...})
+        tagged = exp.add('tagged', tag_corpus, {'articles' : corpus}, {...}, cache=False)
+        exp.run([tagged])
+    '''
+
+    def __init__(self, cache_dir='cache/experiments', workers=4, limits=None):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.limits = limits or {}
+
+
+    def add(self, name, func, inputs=None, params=None, cache=True):
+        return Node(name, func, inputs, params, cache)
+
+
+    def path(self, node):
+        return os.path.join(self.cache_dir, node.name, node.key + '.pkl')
+
+
+    def cached(self, node):
+        return node.cache and os.path.exists(self.path(node))
+
+
+    def load(self, node):
+        with open(self.path(node), 'rb') as fp:
+            return pickle.load(fp)
+
+
+    def save(self, node, result):
+        path = self.path(node)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as fp:
+            pickle.dump(result, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+
+    def plan(self, targets, force=()):
+        '''
+        :return:
+            a (nodes, stale) tuple.  nodes are the nodes needed to produce targets, dependencies first, and
+            stale the keys of those that have to be run rather than loaded: nodes that aren't cached, and
+            nodes of a stage in force along with everything downstream of them.  A node that will be
+            loaded doesn't need its dependencies, so they are left out.
+        '''
+
+        forced = {}
+        def is_forced(node):
+            if node.key not in forced:
+                forced[node.key] = node.name in force or any(is_forced(dep) for dep in node.deps)
+            return forced[node.key]
+
+        order = []
+        seen = set()
+        stale = set()
+        def visit(node):
+            if node.key in seen:
+                return
+            seen.add(node.key)
+            if is_forced(node) or not self.cached(node):
+                stale.add(node.key)
+                for dep in node.deps:
+                    visit(dep)
+            order.append(node)
+        for node in targets:
+            visit(node)
+        return order, stale
+
+
+    def evaluate(self, node, results, stale):
+        if node.key not in stale:
+            return self.load(node)
+        result = node.func(**resolve(node.inputs, lambda dep: results[dep.key]), **node.params)
+        if node.cache:
+            self.save(node, result)
+        return result
+
+
+    def run(self, targets, force=()):
+        '''
+        Produces the results of target nodes, running or loading whatever they need.
+
+        :param
+            targets - a node, or a list or dict of nodes
+            force - stage names to re-run even if cached, e.g. ('related',)
+
+        :return:
+            targets, with each node replaced by its result
+        '''
+
+        order, stale = self.plan(list(nodes_in(targets)), force)
+        waiting = {node.key : node for node in order}
+        results = {}
+        running = {}
+        errors = []
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            while waiting or running:
+                busy = {}
+                for node in running.values():
+                    busy[node.name] = busy.get(node.name, 0) + 1
+                for key, node in list(waiting.items()):
+                    if errors:
+                        break
+                    if key in stale and any(dep.key not in results for dep in node.deps):
+                        continue
+                    if key in stale and busy.get(node.name, 0) >= self.limits.get(node.name, self.workers):
+                        continue
+                    busy[node.name] = busy.get(node.name, 0) + 1
+                    running[pool.submit(self.evaluate, node, results, stale)] = node
+                    del waiting[key]
+
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    try:
+                        results[node.key] = future.result()
+                    except Exception as e:
+                        errors.append((node, e))
+
+        if errors:
+            node, e = errors[0]
+            raise RuntimeError('Stage ' + repr(node) + ' failed') from e
+        return resolve(targets, lambda node: results[node.key])
@@ -1,95 +1,185 @@
 from newspaper import Article, ArticleException
-from bs4 import BeautifulSoup
 from datetime import timedelta
 from datetime import datetime as dtime
 import datetime
 import requests
 import time
 import urllib3
+import http_client
 import random, math
+import json
+import os
+import threading
+import re
+import xml.etree.ElementTree as ET
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+from article_cache import ArticleCache, canonical_url
+from seen_index import SeenIndex
+from dedup import remove_near_duplicates
+from corpus_filters import filter_articles, min_length
+from corpus_store import CorpusStore
+import metrics
 
 
 #hl: language
 #gl: country
 #ceid: country: language
-#(en, jp, fr, de)
-lang_codes = ['en', 'jp', 'fr', 'de', 'it', 'es']
-def get_news_meta_data(keyword='', start_date=0, end_date=0, language='en', depth=0):
+#(en, ja, fr, de)
+lang_codes = ['en', 'ja', 'fr', 'de', 'it', 'es']
+
+#the country google news is queried for, for languages whose code isn't also a country code
+countries = {'en' : 'US', 'ja' : 'JP'}
+
+#scraped articles are cached here and reused across runs.  Set to None to always go to the network,
+#or replace with ArticleCache(offline=True) to only ever read from the cache.
+article_cache = ArticleCache('cache/articles')
+
+
+
+
+#google news returns at most 100 items per query.  A query that comes back with more than FEED_CAP items
+#has probably been truncated, so its date range gets split in two and both halves are queried again.
+FEED_CAP = 85
+
+#the google news RSS search endpoint.  Can be pointed elsewhere, e.g. at the benchmarks' stand-in server.
+GOOGLE_NEWS_RSS = os.environ.get('GOOGLE_NEWS_RSS', 'https://news.google.com/rss/search')
+
+#the process-wide HTTP client: one pool of keep-alive connections, shared by the RSS queries, the article
+#downloads and the ConceptNet lookups, in every thread.
+http = http_client.client
+
+
+
+
+def get_news_meta_data(keyword='', start_date=0, end_date=0, language='en', workers=8, feed_cap=FEED_CAP):
     '''   
     Constructs a query string, and queries google news RSS with it.  Parses the returned metadata,
-    and returns a list of 'item' objects which can be further parsed in order to extract returned
-    articles and further information.
+    and returns a list of article records (title, pubdate, link and source) for further scraping.
 
+    Works as a small query planner.  Any date range that comes back with more than feed_cap items is
+    split in two, and the halves are queried again, until every range is either under the cap or a
+    single day.  Sub-ranges are sent as soon as their parent comes back, concurrently, over the shared
+    connection pool.
 
     Attributes:
-        lang_string - a string to add to the query URL that specifies language and locale
-        query - the final query to pass to google news
-        http - urllib3 object to send the query
-        response - the HTTP response returned from the query
-        soupy - BeautifulSoup object after parsing 'response'
-        items - a list of 'item' object from the returned http.
+        pending - the queries in flight, mapped to the date range each one covers
+        items - the article records from every query that wasn't split
 
     :param
         keyword - the term to search and scrape google news for.
         start_date - the earliest date that scraped articles are published  yyyy-mm-dd format
         end_date - the latest date that scraped articles are published   yyyy-mm-dd format
         language - the language of the articles to look for.
-        depth - how many times to recurse, if the amount of articles is close to 100 (max returned by google news)
+        workers - the most queries in flight at once
+        feed_cap - ranges returning more items than this are split and queried again
 
     :return:
-        A list of 'item' objects that serve as metadata for further scraping.
+        A list of dicts that serve as metadata for further scraping, in the format described in parse_news_feed.
 
     '''
     
     if start_date == 0 or end_date == 0:
         start_date = str(datetime.date.today())
         end_date = str(datetime.date.today() + timedelta(days = 1))
+
+    items = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = {pool.submit(query_news_feed, keyword, start_date, end_date, language) : (start_date, end_date)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                start, end = pending.pop(future)
+                found = future.result()
+
+                if len(found) <= feed_cap or days_between(start, end) <= 1:
+                    items.extend(found)
+                    continue
+
+                mid_date = dtime.strptime(start, "%Y-%m-%d") + timedelta(days=days_between(start, end) // 2)
+                mid_date = mid_date.strftime("%Y-%m-%d")
+                for sub_start, sub_end in ((start, mid_date), (mid_date, end)):
+                    pending[pool.submit(query_news_feed, keyword, sub_start, sub_end, language)] = (sub_start, sub_end)
     
-    if language == 'en':
-        country = 'US'
-    else:
-        country = language
+    return items
+
+
+
+
+
+def query_news_feed(keyword, start_date, end_date, language='en'):
+    '''
+    Sends a single query to google news RSS, over the shared connection pool, and returns the
+    article records in the response.  No splitting is done here, see get_news_meta_data.
+
+    Attributes:
+        lang_string - a string to add to the query URL that specifies language and locale
+        query - the final query to pass to google news
+        response - the HTTP response returned from the query, parsed as it streams in
+
+    :param
+        keyword - the term to search for
+        start_date - the earliest date that scraped articles are published  yyyy-mm-dd format
+        end_date - the latest date that scraped articles are published   yyyy-mm-dd format
+        language - the language of the articles to look for.
+
+    :return:
+        a list of article records, see parse_news_feed
+    '''
+
+    country = countries.get(language, language)
 
     lang_string = '&ceid=' + country + ':' + language + '&hl=' + language + '-' + country + '&gl=' + country
-    query = 'https://news.google.com/rss/search?q=' + keyword + '+after:' + start_date + '+before:' + end_date + lang_string
+    query = GOOGLE_NEWS_RSS + '?q=' + keyword + '+after:' + start_date + '+before:' + end_date + lang_string
     #sample lang string ->    '&ceid=US:en&hl=en-US&gl=US'
     #sample working query ->    https://news.google.com/rss/search?q=usa+after:2022-08-01+before:2022-08-03&ceid=US:en&hl=en-US&gl=US
-    http = urllib3.PoolManager()
-    response = http.request("GET", query)
-    soupy = BeautifulSoup(response.data, 'html.parser')
-    
-    items = soupy.contents[1].find_all('item')
-
-    #if depth is greater than max depth, to change so that a user can enter max articles.  Right now we just recurse once.
-    #max_depth 1 = 100 articles
-    #max_depth 2 = 400 articles
-    #max_depth 3 = 800 articles
-    #amount of articles returns =  100 * 2^max_depth.
-    if(depth == 3):
-        return items
-    
-    if len(items) > 85 and int(days_between(start_date, end_date)) != 1:
-        #drilling once
-        depth+=1
-
-        #parse start_date and end_date to get less articles.
-        d = int(days_between(start_date, end_date)/2)
-        mid_date = dtime.strptime(start_date, "%Y-%m-%d") + timedelta(days=d)
-        mid_date = mid_date.strftime("%Y-%m-%d")
-        
-        if mid_date == start_date:
-            return items
-        
-        items1 = get_news_meta_data(keyword, start_date, mid_date, language, depth)
-        items2 = get_news_meta_data(keyword, mid_date, end_date, language, depth)
-        items = items1 + items2
-    
+    with metrics.span('rss.fetch'), http.stream('GET', query) as response:
+        try:
+            items = list(parse_news_feed(response))
+        finally:
+            metrics.incr('rss.bytes', response.tell())
+    metrics.incr('rss.queries')
+    metrics.incr('rss.items', len(items))
     return items
 
 
 
 
 
+def parse_news_feed(feed):
+    '''
+    Parses an RSS feed incrementally, yielding a small record for each <item> as soon as it has been
+    read, and discarding the item's XML straight away.
+
+    :param
+        feed - a file-like object to read the feed from, such as a streamed HTTP response
+
+    :return:
+        a generator of dicts with the following format
+
+        {'title' : the article title,
+        'pubdate' : the datetime the article was published, or None if the feed didn't give one,
+        'link' : the link to the article online,
+        'source' : the publisher's homepage, or None if the feed didn't give one}
+    '''
+
+    for event, elem in ET.iterparse(feed, events=('end',)):
+        if elem.tag != 'item':
+            continue
+
+        pubdate = elem.findtext('pubDate')
+        source = elem.find('source')
+        yield {'title' : elem.findtext('title'),
+               'pubdate' : parsedate_to_datetime(pubdate) if pubdate else None,
+               'link' : (elem.findtext('link') or '').strip(),
+               'source' : source.get('url') if source is not None else None}
+        elem.clear()
+
+
+
+
+
 
 
 def days_between(d1, d2):
@@ -121,7 +211,8 @@ def days_between(d1, d2):
 def news_items_to_dict(items):
     '''
     Takes in a list of items returned from the get_news_meta_data function, and further
-    parses them to later be scraped.
+    parses them to later be scraped.  get_news_meta_data already returns parsed records, so this
+    only copies them, and is kept for the callers that still go through it.
 
 
     Attributes:
@@ -130,91 +221,291 @@ def news_items_to_dict(items):
         items - a list of metadata items returned from get_news_meta_data
 
     :return:
-        returns a list of dictionaries that have the following format
-
-        {'title' : the article title,
-        'pubdate' : the date the article was published,
-        'link' : the link to the article online}
+        returns a list of dictionaries in the format described in parse_news_feed
     
     '''
-    article_meta_data = []
-    
-    for item in items:
-        title = item.find('title')
-        pubdate = item.find('pubdate')
-
-        stringed = str(item)
-        start = stringed.find('href')
-        stringed = stringed[start+6:]
-        link = stringed[:stringed.find('"')]
-        
-        article_meta_data.append({'title' : title,
-                                 'pubdate' : pubdate,
-                                 'link' : link})
+    article_meta_data = [dict(item) for item in items]
     return article_meta_data
 
 
 
 
 
-def get_article_text(meta_data):
+
+
+def get_article_text(meta_data, timeout=10, cache=None, limiter=None, budget=None):
     '''
     Takes in metadata in the form of a dictionary returned from the news_item_to_dict function.
-    Uses the Article object from the Newspaper3k library to return the text of the article.
+    Downloads the article's page over the shared HTTP client, and uses the Article object from the
+    Newspaper3k library to return the text of the article.
+    The article cache is checked first, and a successful download is added to it.
     
     Attributes:
         a - Newspaper3k Article object.
+        html - the downloaded page
+        entry - the cached copy of the article, if there is one
 
     :param:
         meta_data - a dictionary.  Single article's metadata in the format returned from news_item_to_dict
+        timeout - seconds to wait on the publisher before giving up on the download.
+        cache - the ArticleCache to use.  Defaults to the module's article_cache.
+        limiter - optional HostLimiter to hold while downloading.  Cache hits don't touch it.
+        budget - optional semaphore shared by several scrapes, bounding their downloads in flight altogether
 
     :return:  A string representing the text of an article.
 
     '''
+    if cache is None:
+        cache = article_cache
+
+    if cache is not None:
+        entry = cache.get(meta_data['link'])
+        if entry is not None:
+            metrics.incr('articles.cache_hits')
+            return entry['text']
+        metrics.incr('articles.cache_misses')
+        if cache.offline:
+            raise ArticleException('Not in the article cache, and the cache is offline: ' + meta_data['link'])
+
+    if limiter is not None:
+        host = article_host(meta_data)
+        limiter.acquire(host)
+    if budget is not None:
+        budget.acquire()
+    try:
+        with metrics.span('articles.download'):
+            html = download_html(meta_data['link'], timeout)
+    finally:
+        if budget is not None:
+            budget.release()
+        if limiter is not None:
+            limiter.release(host)
+
     a = Article(meta_data['link'])
-    a.download()
-    a.parse()
+    a.download(input_html=html)
+    with metrics.span('articles.parse'):
+        a.parse()
+
+    if cache is not None:
+        cache.put(meta_data['link'], a.html, a.text)
     return(a.text)
 
 
 
 
 
-def build_corpus(article_meta_data, show_progress=True):
+def download_html(url, timeout=10):
+    '''
+    Helper function.  Downloads an article's page over the shared HTTP client, following redirects, and
+    fails with ArticleException as Article.download would.  The callers' HostLimiter and budget bound the
+    downloads per publisher, so the client's per-host cap, which would hold every news.google.com link
+    to the same few connections, is lifted to its overall limit.
+
+    :return:
+        the page's HTML, as a string
+    '''
+
+    try:
+        response = http.get(url, timeout=timeout, per_host=http.max_in_flight)
+    except urllib3.exceptions.HTTPError as e:
+        raise ArticleException('Article `download()` failed with ' + str(e) + ' on URL ' + url)
+    if response.status >= 400:
+        raise ArticleException('Article `download()` failed with {} {} Error on URL {}'.format(
+            response.status, 'Client' if response.status < 500 else 'Server', url))
+
+    metrics.incr('articles.bytes', len(response.data))
+    return http_client.response_text(response)
+
+
+
+
+
+def failure_reason(error):
+    '''
+    Helper function.  Sorts a failed download into a short reason for the metrics: the HTTP status code
+    when there was one, 'timeout', 'offline' for cache-only misses, or the exception's type.
+    '''
+
+    message = str(error)
+    status = re.search(r'\b([45]\d\d) (Client|Server) Error', message)
+    if status:
+        return status.group(1)
+    if 'timed out' in message.lower() or 'timeout' in message.lower():
+        return 'timeout'
+    if 'cache is offline' in message:
+        return 'offline'
+    return type(error).__name__
+
+
+
+
+
+def article_host(meta_data):
+    '''
+    Helper function.  Returns the host that scraping an article puts load on.  Google News links
+    all point at news.google.com and only redirect to the publisher, so the publisher from the
+    'source' field is preferred when the feed gives one.
+
+    :param
+        meta_data - a single article's metadata in the format returned from news_items_to_dict
+
+    :return:
+        the lowercased host name, e.g. 'www.bbc.co.uk'
+    '''
+    url = meta_data.get('source') or meta_data['link']
+    return urlparse(url).netloc.lower()
+
+
+
+
+
+class HostLimiter:
+    '''
+    Politeness limits for concurrent scraping.  Allows at most 'per_host' downloads in flight against
+    any single host, and spaces the start of consecutive downloads to the same host by 'delay' seconds.
+
+    Attributes:
+        slots - a semaphore per host, bounding the in-flight downloads to it
+        next_start - the earliest time the next download to a host may start
+        lock - guards the two dicts above
+    '''
+
+    def __init__(self, per_host=2, delay=0.5):
+        self.per_host = per_host
+        self.delay = delay
+        self.slots = {}
+        self.next_start = {}
+        self.lock = threading.Lock()
+
+
+    def acquire(self, host):
+        with self.lock:
+            slot = self.slots.setdefault(host, threading.Semaphore(self.per_host))
+        slot.acquire()
+
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start.get(host, now))
+            self.next_start[host] = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+
+
+    def release(self, host):
+        self.slots[host].release()
+
+
+
+
+
+def iter_corpus(article_meta_data, show_progress=True, workers=8, per_host=2, host_delay=0.5, timeout=10, cache=None, seen=None,
+                limiter=None, budget=None, claims=None):
     '''
     Takes in a list of dict, as returned from the method news_items_to_dict().  Scrapes each article according
-    to the links in the metadata and returns a list of the articles' text.
+    to the links in the metadata and yields each article's text as soon as it has been scraped, so that later
+    stages can start on it while the rest download.  Downloads run concurrently on a thread pool, since nearly
+    all of the time is spent waiting on publishers.  Articles already in the article cache are read from it
+    instead.  Links that canonicalize to the same URL are only scraped once, and with a SeenIndex, links
+    scraped by any earlier call are skipped before anything is downloaded.
 
     Attributes:
-        articles - the list of articles
+        skipped - how many articles were left out as duplicates or already seen
         fails - how many times this method raised an ArticleException (when we get a 404 or something like that)
         processed - how many articles are done processing.  used to give some feedback on the progress to the user.
+        limiter - HostLimiter enforcing the per-host politeness limits
 
     :params
         article_meta_data - a list of dict object containing the metadata, and the link of the article to scrape
         show_progress - If set to false, will show the progress of the article scraping.
+        workers - the most downloads in flight at once, across all hosts.  1 scrapes serially.
+        per_host - the most downloads in flight at once against a single host
+        host_delay - minimum number of seconds between starting two downloads from the same host
+        timeout - per-request timeout in seconds
+        cache - the ArticleCache to read from and add to.  Defaults to the module's article_cache.
+        seen - optional SeenIndex.  Articles in it are skipped, and scraped articles are added to it.
+        claims - optional set.  If given, articles are claimed in seen (SeenIndex.claim) rather than added,
+                 and the links of those that were scraped are put in claims, for the caller to add once
+                 they are saved or to release if they aren't.  The claims of failed downloads, and of
+                 any left when the scrape stops, are released here.  See get_articles_incrementing_date.
+        limiter - optional HostLimiter to share with other scrapes running at the same time.  Replaces
+                  per_host and host_delay.
+        budget - optional semaphore shared with other scrapes, bounding their downloads in flight altogether
 
     :return:
-        articles - the list, each element is the text of an article.  A corpus of documents to do some analysis on,
-        and generate the related terms.  
+        a generator of (index, text) tuples, index being the article's position in article_meta_data,
+        in the order the articles finish downloading
 
     '''
-    articles = []
+    unique = {}
+    for i, article in enumerate(article_meta_data):
+        url = canonical_url(article['link'])
+        if url in unique:
+            continue
+        if seen is not None and not (seen.claim(url) if claims is not None else url not in seen):
+            continue
+        unique[url] = i
+    skipped = len(article_meta_data) - len(unique)
+
     fails = 0
     processed=0
-    print('Building corpus from ' + str(len(article_meta_data)) + ' articles...')
-    for article in article_meta_data:
-        processed+=1
-        try:
-            articles.append(get_article_text(article))
-        except ArticleException:
-            fails += 1
-
-        if show_progress == True:
-            print('Progress: {:.2f} %    Fail Rate: {:.2f} %  '.format(processed/len(article_meta_data) * 100, fails/processed * 100), end='\r')
+    if limiter is None:
+        limiter = HostLimiter(per_host, host_delay)
+    print('Building corpus from ' + str(len(unique)) + ' articles (' + str(skipped) + ' skipped as already seen)...')
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        futures = {pool.submit(get_article_text, article_meta_data[i], timeout, cache, limiter, budget) : i
+                   for i in unique.values()}
+        for future in as_completed(futures):
+            processed+=1
+            i = futures[future]
+            try:
+                text = future.result()
+            except ArticleException as e:
+                fails += 1
+                metrics.incr('articles.failures.' + failure_reason(e))
+                text = None
+            if seen is not None and claims is not None:
+                if text is not None:
+                    claims.add(article_meta_data[i]['link'])
+            elif text is not None and seen is not None:
+                seen.add(article_meta_data[i]['link'])
+
+            if show_progress == True:
+                print('Progress: {:.2f} %    Fail Rate: {:.2f} %  '.format(processed/len(futures) * 100, fails/processed * 100), end='\r')
+            if text is not None:
+                yield i, text
+    finally:
+        #if the consumer stops early, don't download the rest
+        pool.shutdown(wait=False, cancel_futures=True)
+        #claims that weren't handed over in claims would otherwise be held for good
+        if seen is not None and claims is not None:
+            for i in unique.values():
+                if article_meta_data[i]['link'] not in claims:
+                    seen.release(article_meta_data[i]['link'])
     print('Complete          ')
+
+
+
+
+
+def build_corpus(article_meta_data, show_progress=True, **kwargs):
+    '''
+    Takes in a list of dict, as returned from the method news_items_to_dict().  Scrapes each article according
+    to the links in the metadata and returns a list of the articles' text.  See iter_corpus for the scraping.
+
+    :params
+        article_meta_data - a list of dict object containing the metadata, and the link of the article to scrape
+        show_progress - If set to false, will show the progress of the article scraping.
+        kwargs - passed on to iter_corpus: workers, per_host, host_delay, timeout, cache and seen
+
+    :return:
+        articles - the list, each element is the text of an article, in the same order as article_meta_data.
+        A corpus of documents to do some analysis on, and generate the related terms.
+
+    '''
+    articles = sorted(iter_corpus(article_meta_data, show_progress, **kwargs))
     
-    return articles
+    return [text for i, text in articles]
 
 
 
@@ -252,7 +543,8 @@ def get_news_articles_text(keyword='', start_date=0, end_date=0, language='en',)
 
 
 
-def create_articles_from_keyphrase(keyword='', start_date=0, end_date=0, language='en',):
+def create_articles_from_keyphrase(keyword='', start_date=0, end_date=0, language='en', seen=None, duplicate_threshold=0.8,
+                                   show_progress=True, stats=None, with_meta=False, **scrape_args):
     '''
         Puts all the above methods together to query Google News.  Scrapes all the articles and puts
         them into a list of articles.  The main method to build a corpus from Google News for later NLP analysis.
@@ -264,20 +556,43 @@ def create_articles_from_keyphrase(keyword='', start_date=0, end_date=0, languag
             keyword - the term to search for
             start_date - the earliest date of the articles
             end_date - the latest date of the articles
-            language - language of articles to search for.
+            language - language of articles to search for.  Scraped articles in any other language are dropped.
+            seen - optional SeenIndex of articles scraped before, which are skipped
+            duplicate_threshold - articles at least this similar (estimated Jaccard similarity of their
+                                  5-word shingles) are collapsed into one, see dedup.remove_near_duplicates.
+                                  None keeps them all.
+            show_progress - whether to show the progress of the article scraping
+            stats - optional dict, filled in with the number of feed 'items' found and 'articles' kept
+            with_meta - if True, return article records instead of strings: the feed metadata of
+                        each article (see parse_news_feed) plus its 'text', 'language' and 'keyword'
+            scrape_args - passed on to iter_corpus, e.g. workers, limiter or budget
 
         :return:
             articles - a list of strings, each element corresponding to the body of an article.
+                       Records if with_meta is True.
 
     '''
 
     print('Querying ' + language + ' articles...')
     articles = get_news_meta_data(keyword, start_date, end_date, language)
-    articles = list(set(articles))
+    articles = list({canonical_url(a['link']) : a for a in articles}.values())
     print('Number of articles retrieved: ' + str(len(articles)))
+    if stats is not None:
+        stats['items'] = len(articles)
     articles = news_items_to_dict(articles)
-    articles = build_corpus(articles)
-    remove_short(articles)
+    #scraped articles are filtered one at a time as they arrive, only survivors are kept
+    scraped = iter_corpus(articles, show_progress, seen=seen, **scrape_args)
+    if with_meta:
+        scraped = (dict(articles[i], text=text, language=language, keyword=keyword) for i, text in scraped)
+    else:
+        scraped = (text for i, text in scraped)
+    articles = list(filter_articles(scraped, language))
+    if duplicate_threshold is not None:
+        scraped = len(articles)
+        articles = remove_near_duplicates(articles, duplicate_threshold)
+        print('Removed ' + str(scraped - len(articles)) + ' near-duplicate articles')
+    if stats is not None:
+        stats['articles'] = len(articles)
     print('\n\n')
     return articles
 
@@ -288,14 +603,53 @@ def create_articles_from_keyphrase(keyword='', start_date=0, end_date=0, languag
 
 
 
+def collect_languages(keyphrase, start_date, end_date, languages=None, scrape_budget=16, **kwargs):
+    '''
+    Builds corpora for several languages at once.  Every language is queried and scraped concurrently, and
+    all of them share one budget of downloads in flight and one set of per-host politeness limits, so that
+    adding languages doesn't multiply the load on any publisher.
+
+    Attributes:
+        budget - semaphore bounding the downloads in flight across all languages
+        limiter - HostLimiter shared by all languages
+
+    :param
+        keyphrase - the term to search for, either one string for every language, or a dict from
+                    language code to that language's term, e.g. {'en' : 'africa', 'fr' : 'afrique'}
+        start_date - the earliest date of the articles
+        end_date - the latest date of the articles
+        languages - the language codes to collect.  Defaults to the keys of keyphrase if it is a dict,
+                    and to lang_codes otherwise.
+        scrape_budget - the most article downloads in flight at once, over all languages
+        kwargs - passed on to create_articles_from_keyphrase
+
+    :return:
+        a dict from language code to that language's corpus, a list of article strings
+    '''
+
+    if languages is None:
+        languages = list(keyphrase) if isinstance(keyphrase, dict) else lang_codes
+    if not isinstance(keyphrase, dict):
+        keyphrase = {language : keyphrase for language in languages}
+
+    budget = threading.Semaphore(scrape_budget)
+    limiter = HostLimiter()
+    kwargs.setdefault('show_progress', False)
+    kwargs.setdefault('workers', scrape_budget)
+    with ThreadPoolExecutor(max_workers=len(languages)) as pool:
+        futures = {language : pool.submit(create_articles_from_keyphrase, keyphrase[language], start_date, end_date,
+                                          language, budget=budget, limiter=limiter, **kwargs)
+                   for language in languages}
+        return {language : future.result() for language, future in futures.items()}
+
+
+
+
+
 def multi_lang_articles(keyphrase, start_date, end_date):
     '''
     Attributes:
-        arts_en - corpus of english articles
-        arts_fr - corpus of french articles
-        arts_de - corpus of german articles
-        arts_es - corpus of spanish articles
-        arts_it - corpus of italian articles
+        corpora - the corpus of each language, collected concurrently by collect_languages
 
 
     :param
@@ -308,18 +662,9 @@ def multi_lang_articles(keyphrase, start_date, end_date):
         English, French, German, Spanish, Italian.
     '''
 
-    arts_en = create_articles_from_keyphrase(keyphrase, start_date, end_date, 'en')
-    print('\n')
-    arts_fr = create_articles_from_keyphrase(keyphrase, start_date, end_date, 'fr')
-    print('\n')
-    arts_de = create_articles_from_keyphrase(keyphrase, start_date, end_date, 'de')
-    print('\n')
-    arts_es = create_articles_from_keyphrase(keyphrase, start_date, end_date, 'es')
-    print('\n')
-    arts_it = create_articles_from_keyphrase(keyphrase, start_date, end_date, 'it')
-    print('\n')
+    corpora = collect_languages(keyphrase, start_date, end_date, ['en', 'fr', 'de', 'es', 'it'])
     
-    return arts_en, arts_fr, arts_de, arts_es, arts_it
+    return corpora['en'], corpora['fr'], corpora['de'], corpora['es'], corpora['it']
 
 
 
@@ -351,9 +696,12 @@ def flatten_corpus(articles):
 
 
 def remove_short(articles):
-    for a in articles:
-        if (len(a)) < 500:
-            del articles[articles.index(a)]
+    '''
+    Removes articles under 500 characters from the list, in place.  New code should chain the
+    generators in corpus_filters instead.
+    '''
+    articles[:] = min_length(articles, 500)
+
 
 
 
@@ -361,38 +709,181 @@ def remove_short(articles):
 
 
 
+def clean_and_save(articles, keyword, start, end, language='en', store=None):
+    '''
+    Removes short articles and saves the rest as one shard of a CorpusStore, with their metadata when
+    they are records.  Read them back with corpus_store.load_corpus or CorpusStore.iter_records.
+
+    :param
+        articles - a list of article strings, or of records as returned by create_articles_from_keyphrase with with_meta
+        keyword, start, end, language - what the articles are, the shard is filed under them
+        store - the CorpusStore to save to.  Defaults to one in 'articles/'.
 
-def clean_and_save(articles, keyword, start, end):
+    :return:
+        the path of the shard written
+    '''
     remove_short(articles)
-    
-    filename = 'articles/' + keyword + ' ' + start + ' ' + end + '.txt'
-    # open file in write mode
-    with open(filename, 'w', encoding='utf-8') as fp:
-        for art in articles:
-            # write each item on a new line
-            fp.write("%s\n" % art)
-        print('Wrote articles to txt\n')
 
+    if store is None:
+        store = CorpusStore('articles')
+    filename = store.write_shard(articles, keyword, language, start, end)
+    print('Wrote ' + str(len(articles)) + ' articles to ' + filename + '\n')
+    return filename
 
 
 
 
 
 
-def get_articles_incrementing_date(keyword):
-    
-    start = '2022-01-01'
-    
-    while dtime.strptime(start, "%Y-%m-%d") < datetime.datetime.today():
-        end = dtime.strptime(start, "%Y-%m-%d") + datetime.timedelta(days=20)
-        end = end.strftime("%Y-%m-%d")
-        
-        print('Using date ranges ' + start + ' ' + end)
-        articles = create_articles_from_keyphrase(keyword, start, end)
-        clean_and_save(articles, keyword, start, end)
 
-        start=dtime.strptime(end, "%Y-%m-%d") + datetime.timedelta(days=1)
-        start = start.strftime("%Y-%m-%d")
+def date_windows(start, end, window_days=20):
+    '''
+    Helper function.  Splits the dates from start up to (not including) end into consecutive windows of
+    window_days days.  google news' 'before:' is exclusive, so each window ends on the day the next starts.
+
+    :return:
+        a list of (start, end) yyyy-mm-dd tuples.  The last window keeps its full length even if it runs
+        past end, so that a window is named the same however far it has been crawled.
+    '''
+
+    windows = []
+    day = dtime.strptime(start, "%Y-%m-%d")
+    last = dtime.strptime(end, "%Y-%m-%d")
+    while day < last:
+        next_day = day + timedelta(days=window_days)
+        windows.append((day.strftime("%Y-%m-%d"), next_day.strftime("%Y-%m-%d")))
+        day = next_day
+    return windows
+
+
+
+
+
+def load_manifest(path):
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as fp:
+            return json.load(fp)
+    return {'windows' : {}}
+
+
+def save_manifest(manifest, path):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as fp:
+        json.dump(manifest, fp, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+
+
+
+def get_articles_incrementing_date(keyword, start='2022-01-01', end=None, language='en', window_days=20, workers=2,
+                                   incremental=False, manifest_path='articles/manifest.json', seen=None):
+    '''
+    Crawls google news for a keyword over a long period, one date window at a time, and saves each window's
+    articles with clean_and_save.  The crawl is resumable: every finished window is recorded in a manifest
+    file with its item and article counts, and windows already in it are skipped, so a crashed or repeated
+    backfill only does the work that is missing.  Windows are always window_days long and keyed by their
+    full span, while the day a window was crawled up to is recorded separately.  A window that reaches
+    today, or that end cuts short, is saved but recorded as partial, and crawled again on the next run
+    since more news may come in.  Re-crawling a window adds the new articles to the ones already saved
+    for it, under the same key and shard, so a daily cron run keeps extending one window.
+
+    Articles are claimed in the SeenIndex as they are scraped, so windows crawled at once don't both
+    download what google returns for both, but they are only added to it once their window's shard has
+    been written.  The claims of a window that fails are released, so it is scraped again in full on the
+    next run.
+
+    Attributes:
+        manifest - the crawled windows, keyed by 'keyword|language|start|end'
+        windows - the windows still to crawl
+        seen - SeenIndex shared by all the windows, they overlap in what google returns
+        saved - the articles already in a window's shard, when it is crawled again
+        stale - partial entries of the same start under another end, as recorded when windows were cut
+                short at the crawl's end.  Their articles are folded into the window and the entries dropped.
+        claims - the links a window has claimed in seen
+
+    :param
+        keyword - the term to search for
+        start - the first day to crawl, yyyy-mm-dd
+        end - the day to stop before.  Defaults to tomorrow, so that today is included.
+        language - the language of the articles
+        window_days - the length of a window
+        workers - how many windows to crawl at once
+        incremental - if True, start where the last complete window of this keyword and language ended
+                      instead of at 'start', for cron use
+        manifest_path - where the manifest is kept
+        seen - optional SeenIndex.  Defaults to cache/seen/keyword/language.bin, one per keyword and
+               language, so that crawling one keyword doesn't hide articles from another's corpus.
+
+    :return:
+        the manifest entries of the windows crawled by this call
+    '''
+
+    if end is None:
+        end = str(datetime.date.today() + timedelta(days=1))
+    today = str(datetime.date.today())
+    if seen is None:
+        seen = SeenIndex(os.path.join('cache', 'seen', keyword, language + '.bin'))
+    store = CorpusStore('articles')
+
+    manifest = load_manifest(manifest_path)
+    done = {key : entry for key, entry in manifest['windows'].items()
+            if entry['keyword'] == keyword and entry['language'] == language and not entry['partial']}
+    if incremental and done:
+        start = max(start, max(entry['end'] for entry in done.values()))
+
+    key = lambda w: '|'.join([keyword, language, w[0], w[1]])
+    windows = [w for w in date_windows(start, end, window_days) if key(w) not in done]
+    print(str(len(windows)) + ' windows to crawl, ' + str(len(done)) + ' already done')
+    lock = threading.Lock()
+
+    def crawl(window):
+        crawled_to = min(window[1], end)
+        print('Using date ranges ' + window[0] + ' ' + crawled_to)
+        stats = {}
+        path = store.shard_path(keyword, language, window[0], window[1])
+        with lock:
+            stale = {k : e for k, e in manifest['windows'].items() if e['keyword'] == keyword and e['language'] == language
+                     and e['start'] == window[0] and e['partial'] and k != key(window)}
+        saved = []
+        for shard in [path] + [e['file'] for e in stale.values() if e['file'] != path]:
+            if os.path.exists(shard):
+                saved += store.records(shard)
+        saved = list({canonical_url(a['link']) if a.get('link') else i : a for i, a in enumerate(saved)}.values())
+
+        claims = set()
+        try:
+            scraped = create_articles_from_keyphrase(keyword, window[0], crawled_to, language, seen=seen,
+                                                     show_progress=workers == 1, stats=stats, with_meta=True,
+                                                     claims=claims)
+            saved_urls = {canonical_url(a['link']) for a in saved if a.get('link')}
+            scraped = [a for a in scraped if canonical_url(a['link']) not in saved_urls]
+            articles = saved + scraped
+            filename = clean_and_save(articles, keyword, window[0], window[1], language, store)
+        except BaseException:
+            for link in claims:
+                seen.release(link)
+            raise
+        for link in claims:
+            seen.add(link)
+
+        entry = {'keyword' : keyword, 'language' : language, 'start' : window[0], 'end' : window[1],
+                 'crawled_to' : crawled_to, 'items' : stats['items'], 'articles' : len(articles), 'file' : filename,
+                 'partial' : crawled_to < window[1] or crawled_to > today,
+                 'completed' : dtime.now().isoformat(timespec='seconds')}
+        with lock:
+            for k, e in stale.items():
+                manifest['windows'].pop(k, None)
+            manifest['windows'][key(window)] = entry
+            save_manifest(manifest, manifest_path)
+        for e in stale.values():
+            if e['file'] != filename:
+                store.remove_shard(e['file'])
+        return entry
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(crawl, windows))
 
 
 
@@ -413,8 +904,9 @@ def generate_test_corpora(start):
         next_ = next_.strftime("%Y-%m-%d")
         print(next_)
 
-        arts_en.append(create_articles_from_keyphrase('africa', start, next_, language='en'))
-        arts_fr.append(create_articles_from_keyphrase('afrique', start, next_, language='fr'))
+        corpora = collect_languages({'en' : 'africa', 'fr' : 'afrique'}, start, next_)
+        arts_en.append(corpora['en'])
+        arts_fr.append(corpora['fr'])
 
         days_ = days_ + 1
 
@@ -0,0 +1,196 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import urllib3
+from urllib3.util import Retry, Timeout, make_headers
+import metrics
+
+
+#publishers turn away clients that don't look like a browser
+USER_AGENT = ('Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
+              'Chrome/120.0 Safari/537.36')
+
+#statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+#redirects are followed up to the limit requests has, and don't use up any retries
+MAX_REDIRECTS = 30
+
+
+
+
+class HttpClient:
+    '''
+    One pool of keep-alive connections shared by everything that goes over HTTP: the google news RSS
+    queries, article downloads and ConceptNet lookups.  Connections to a host are reused across calls
+    and threads, so each host costs one TCP and TLS handshake per pooled connection rather than one per
+    request.  Responses are asked for compressed and decompressed on the fly.
+
+    Failed requests are retried with exponential backoff on connection errors, 429 and 5xx responses,
+    honouring Retry-After.  Once the retries run out, the last response is returned, and callers check
+    its status.  Redirects are followed separately, and don't count as retries.
+
+    Callers that already bound their own load per host, as scrapes do with a HostLimiter, can ask for a
+    larger per-host cap on a request.  Every google news article link goes through news.google.com
+    before redirecting to its publisher, so without that all the article downloads would queue for the
+    same per_host connections.
+
+    Attributes:
+        pool - the urllib3 PoolManager.  It keeps up to per_host connections per host, and with block=True
+               further requests to that host wait for one to free up, which bounds the load on any one host.
+        pools - the PoolManagers by per-host cap, including pool, the others created on first use
+        slots - semaphore bounding the requests in flight over all hosts
+        executor - thread pool behind submit(), created on first use
+
+    :param
+        max_in_flight - the most requests in flight at once
+        per_host - the most connections open to any one host
+        retries - how many times a request is retried
+        backoff - the first retry waits this many seconds, and each one after waits twice as long
+        timeout - seconds to wait for a connection, and then for the response
+    '''
+
+    def __init__(self, max_in_flight=32, per_host=8, retries=3, backoff=0.5, timeout=30, headers=None):
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.headers = make_headers(accept_encoding=True, keep_alive=True, user_agent=USER_AGENT)
+        self.headers.update(headers or {})
+        self.per_host = per_host
+        self.pools = {}
+        self.pool = self.pool_for(per_host)
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.executor = None
+        self.lock = threading.Lock()
+
+
+    def retry_policy(self, retries):
+        return Retry(total=None, connect=retries, read=retries, status=retries, other=retries, redirect=MAX_REDIRECTS,
+                     backoff_factor=self.backoff, status_forcelist=RETRY_STATUSES,
+                     respect_retry_after_header=True, raise_on_status=False)
+
+
+    def pool_for(self, per_host):
+        '''
+        Returns the PoolManager keeping up to per_host connections per host, creating it on first use.
+        '''
+
+        if per_host not in self.pools:
+            self.pools[per_host] = urllib3.PoolManager(num_pools=64, maxsize=per_host, block=True, headers=self.headers,
+                                                       retries=self.retry_policy(self.retries),
+                                                       timeout=Timeout(self.timeout))
+        return self.pools[per_host]
+
+
+    def request(self, method, url, fields=None, headers=None, retries=None, timeout=None, per_host=None):
+        '''
+        Sends a request and reads the whole response.
+
+        :param
+            method - 'GET', 'POST', ...
+            url - the URL
+            fields - query parameters, as a dict
+            headers - headers to send besides the client's defaults
+            retries - overrides the client's retry count for this request
+            timeout - overrides the client's timeout for this request, in seconds
+            per_host - overrides the client's per-host connection cap for this request
+
+        :return:
+            the urllib3 HTTPResponse, with its body in .data
+        '''
+
+        with self.slots:
+            return self._send(method, url, fields, headers, retries, timeout, per_host, True)
+
+
+    def get(self, url, fields=None, **kwargs):
+        return self.request('GET', url, fields, **kwargs)
+
+
+    @contextmanager
+    def stream(self, method, url, fields=None, headers=None, retries=None, timeout=None, per_host=None):
+        '''
+        Sends a request and yields the response unread, so the body can be parsed as it arrives.  The
+        connection goes back to the pool when the block exits.
+        '''
+
+        with self.slots:
+            response = self._send(method, url, fields, headers, retries, timeout, per_host, False)
+            try:
+                yield response
+            finally:
+                response.release_conn()
+
+
+    def _send(self, method, url, fields, headers, retries, timeout, per_host, preload_content):
+        if per_host is None:
+            pool = self.pool
+        else:
+            with self.lock:
+                pool = self.pool_for(per_host)
+        kwargs = {}
+        if retries is not None:
+            kwargs['retries'] = self.retry_policy(retries)
+        if timeout is not None:
+            kwargs['timeout'] = Timeout(timeout)
+
+        response = pool.request(method, url, fields=fields, headers=headers,
+                                     preload_content=preload_content, **kwargs)
+        metrics.incr('http.requests')
+        if response.retries is not None and response.retries.history:
+            for attempt in response.retries.history:
+                if attempt.redirect_location:
+                    continue
+                metrics.incr('http.retries.' + str(attempt.status or type(attempt.error).__name__))
+        return response
+
+
+    def submit(self, method, url, **kwargs):
+        '''
+        Sends a request in the background.
+
+        :return:
+            a Future of the response, see request
+        '''
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        return self.executor.submit(self.request, method, url, **kwargs)
+
+
+    def get_many(self, urls, **kwargs):
+        '''
+        Fetches several URLs concurrently.
+
+        :return:
+            the responses, in the order of urls.  A request that raised has its exception in its place.
+        '''
+
+        futures = [self.submit('GET', url, **kwargs) for url in urls]
+        return [f.exception() or f.result() for f in futures]
+
+
+
+
+
+def response_text(response, default_charset='utf-8'):
+    '''
+    Helper function.  Decodes a response body with the charset from its Content-Type, if it gives one.
+    '''
+
+    charset = re.search(r'charset=["\']?([\w.:-]+)', response.headers.get('Content-Type', ''))
+    try:
+        return response.data.decode(charset.group(1) if charset else default_charset, errors='replace')
+    except LookupError:
+        return response.data.decode(default_charset, errors='replace')
+
+
+
+
+
+#shared by every module of the process, so that connections are reused across all of them
+client = HttpClient()
@@ -0,0 +1,160 @@
+from gensim.models import Word2Vec, FastText, KeyedVectors
+import json
+import os
+
+
+model_classes = {'word2vec' : Word2Vec, 'fasttext' : FastText}
+
+
+
+
+class IncrementalModel:
+    '''
+    A Word2Vec or FastText model that is kept across date windows.  Each new window's sentences extend its
+    vocabulary and continue training its weights, instead of training a new model on the whole corpus.
+    After every window a snapshot of the word vectors is taken, so the neighbours of a term can be looked
+    up as they were at any window so far.
+
+    Snapshots keep only the vectors of in-vocabulary words as plain KeyedVectors.  For FastText this drops
+    the n-gram buckets (hundreds of MB per model), so a snapshot can't build vectors for unseen words.
+
+    With a snapshot_dir, the full model and the list of labels are saved there too after every window,
+    and restore() picks them up in a later process, so a daily run continues training where the last
+    one stopped and can still query every earlier window.
+
+    Attributes:
+        model - the gensim model, None until the first window
+        snapshots - maps each window's label to its KeyedVectors, or to the file it was saved to
+        labels - the window labels, in the order they were added
+
+    :param
+        method - 'word2vec' or 'fasttext'
+        snapshot_dir - if given, snapshots are saved here and memory-mapped back in when queried,
+                       rather than kept in memory
+        window, min_count, workers, kwargs - passed to the gensim model.  min_count applies to each
+                       window's new sentences.
+    '''
+
+    def __init__(self, method='word2vec', snapshot_dir=None, window=5, min_count=2, workers=4, **kwargs):
+        self.method = method
+        self.snapshot_dir = snapshot_dir
+        self.params = dict(kwargs, window=window, min_count=min_count, workers=workers)
+        self.model = None
+        self.snapshots = {}
+        self.labels = []
+
+
+    def update(self, sentences, label):
+        '''
+        Trains on one more window of sentences and snapshots the result under label.
+
+        :param
+            sentences - a list of sentences, each a list of tokens, as returned by sentence_tokenize
+            label - names the window, e.g. its start date
+        '''
+
+        if self.model is None:
+            self.model = model_classes[self.method](sentences=sentences, **self.params)
+        else:
+            self.model.build_vocab(sentences, update=True)
+            self.model.train(sentences, total_examples=len(sentences), epochs=self.model.epochs)
+        self.snapshot(label)
+        if self.snapshot_dir is not None:
+            self.save()
+
+
+    def save(self):
+        '''
+        Saves the full model, and the window labels in order, to snapshot_dir.
+        '''
+
+        self.model.save(os.path.join(self.snapshot_dir, 'model.gensim'))
+        path = os.path.join(self.snapshot_dir, 'labels.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as fp:
+            json.dump([str(label) for label in self.labels], fp)
+        os.replace(path + '.tmp', path)
+
+
+    def restore(self):
+        '''
+        Loads the model and the snapshot labels saved in snapshot_dir by an earlier process, if there are any.
+
+        :return:
+            True if a saved model was found
+        '''
+
+        model_path = os.path.join(self.snapshot_dir, 'model.gensim')
+        if not os.path.exists(model_path):
+            return False
+        self.model = model_classes[self.method].load(model_path)
+        with open(os.path.join(self.snapshot_dir, 'labels.json'), encoding='utf-8') as fp:
+            for label in json.load(fp):
+                if label not in self.snapshots:
+                    self.labels.append(label)
+                    self.snapshots[label] = os.path.join(self.snapshot_dir, label + '.kv')
+        return True
+
+
+    def snapshot(self, label):
+        wv = self.model.wv
+        vectors = KeyedVectors(wv.vector_size)
+        vectors.add_vectors(wv.index_to_key, wv.vectors)
+
+        if self.snapshot_dir is not None:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            path = os.path.join(self.snapshot_dir, str(label) + '.kv')
+            vectors.save(path)
+            vectors = path
+
+        if label not in self.snapshots:
+            self.labels.append(label)
+        self.snapshots[label] = vectors
+
+
+    def vectors(self, label=None):
+        '''
+        :return:
+            the KeyedVectors as of the window 'label', or as of the latest window if label is None
+        '''
+
+        if label is None:
+            label = self.labels[-1]
+        if label not in self.snapshots and self.snapshot_dir is not None:
+            path = os.path.join(self.snapshot_dir, str(label) + '.kv')
+            if os.path.exists(path):
+                self.snapshots[label] = path
+        vectors = self.snapshots[label]
+        if isinstance(vectors, str):
+            vectors = KeyedVectors.load(vectors, mmap='r')
+        return vectors
+
+
+    def most_similar(self, keyword, label=None, topn=8):
+        return self.vectors(label).most_similar(keyword, topn=topn)
+
+
+
+
+
+#the incremental models of this process, keyed by (keyword, language, method)
+_models = {}
+
+
+
+
+def get_incremental_model(keyword, language='en', method='word2vec', snapshot_dir='cache/models', **kwargs):
+    '''
+    Returns the incremental model for a keyword, language and method, creating it on first use, or
+    restoring it if an earlier process saved it.  The model and its snapshots go under
+    snapshot_dir/keyword/language/method; pass snapshot_dir=None to keep them in memory.
+    '''
+
+    key = (keyword, language, method)
+    if key not in _models:
+        if snapshot_dir is not None:
+            snapshot_dir = os.path.join(snapshot_dir, keyword, language, method)
+        model = IncrementalModel(method, snapshot_dir, **kwargs)
+        if snapshot_dir is not None:
+            model.restore()
+        _models[key] = model
+    return _models[key]
@@ -0,0 +1,166 @@
+import atexit
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+#upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, math.inf)
+
+
+
+
+class Histogram:
+    '''
+    Counts observations into fixed BUCKETS, and keeps their count, sum, min and max.  Constant memory
+    however many values are observed.
+    '''
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+
+    def observe(self, value):
+        i = 0
+        while value > BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+
+    def to_dict(self):
+        return {'count' : self.count, 'sum' : self.total,
+                'min' : self.min if self.count else None, 'max' : self.max if self.count else None,
+                'buckets' : {('inf' if b == math.inf else str(b)) : n for b, n in zip(BUCKETS, self.buckets) if n}}
+
+
+
+
+
+class Metrics:
+    '''
+    Process-wide counters and latency histograms for the pipeline stages.  Recording is a dict update
+    under a lock, cheap enough to leave on; set NLP_METRICS=0 to turn it off entirely.
+
+    Names are dotted, stage first: 'articles.download' times downloads, 'articles.cache_hits' counts
+    cache hits, 'articles.failures.404' counts one failure reason.
+
+    Attributes:
+        enabled - whether anything is recorded
+        counters - maps each counter name to its total
+        histograms - maps each timing name to its Histogram, in seconds
+    '''
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+
+    def incr(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def observe(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+
+    @contextmanager
+    def span(self, name):
+        '''
+        Times the block under 'name'.  If it raises, the exception type is counted under name.errors.
+        '''
+
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.incr(name + '.errors.' + type(e).__name__)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+
+    def timed(self, name=None):
+        '''
+        Decorator version of span.  The name defaults to the function's module and name.
+        '''
+
+        def decorate(func):
+            span_name = name or func.__module__ + '.' + func.__name__
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+
+    def snapshot(self):
+        with self.lock:
+            return {'time' : time.time(), 'pid' : os.getpid(),
+                    'counters' : dict(self.counters),
+                    'histograms' : {name : h.to_dict() for name, h in self.histograms.items()}}
+
+
+    def export(self, path):
+        '''
+        Appends a snapshot to path as one JSON line, so repeated runs build up a history.
+        '''
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as fp:
+            fp.write(json.dumps(self.snapshot()) + '\n')
+
+
+    def log(self, logger=None, level=logging.INFO):
+        (logger or logging.getLogger('metrics')).log(level, json.dumps(self.snapshot()))
+
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+
+
+
+#shared by every module of the process
+metrics = Metrics(enabled=os.environ.get('NLP_METRICS', '1') != '0')
+
+incr = metrics.incr
+observe = metrics.observe
+span = metrics.span
+timed = metrics.timed
+
+
+#with NLP_METRICS_FILE set, a snapshot is appended to that file when the process exits
+if os.environ.get('NLP_METRICS_FILE'):
+    atexit.register(metrics.export, os.environ['NLP_METRICS_FILE'])
@@ -1,17 +1,86 @@
 from nltk.corpus import stopwords
 from gensim.models import Word2Vec, FastText
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from collections import namedtuple, deque
+from bisect import bisect_left
+import multiprocessing
+import hashlib
+import os
+import tempfile
+import time
 import nltk
 import requests
 import stanza
 from g_news_corpus import *
+from tagged_corpus import TaggedCorpus, FrequencyIndex
+from incremental import get_incremental_model
+from corpus_filters import stopword_languages, article_text
+from functools import lru_cache
+import metrics
 
 
 
 
-def run_stanza_pipeline(articles, language='en'):
-    nlp = stanza.Pipeline(language, processors='tokenize,pos,lemma')
-    flattened_articles = flatten_corpus(articles)
-    tagged_corpus = nlp(flattened_articles)
+#stanza pipelines already loaded in this process, keyed by (language, processors).  Loading the
+#models is about as slow as tagging a day of news, so a pipeline is only ever built once.
+_pipelines = {}
+
+
+
+
+def get_pipeline(language='en', processors='tokenize,pos,lemma', download_method=stanza.DownloadMethod.REUSE_RESOURCES):
+    '''
+    Returns the process-wide stanza pipeline for a language and set of processors, building it on first use.
+    By default missing models are downloaded, without fetching stanza's resources.json again if it is
+    there.  With download_method=None nothing is downloaded, and missing models raise instead.
+    '''
+
+    key = (language, processors)
+    if key not in _pipelines:
+        _pipelines[key] = stanza.Pipeline(language, processors=processors, download_method=download_method)
+    return _pipelines[key]
+
+
+
+
+
+def run_stanza_pipeline(articles, language='en', batch_size=None, processors='tokenize,pos,lemma', workers=None, compact=False):
+    '''
+    Tags a corpus with a stanza pipeline.
+
+    :param
+        articles - the corpus, a list of article strings.  With batch_size or workers, any iterable of article
+                   strings or records (see iter_tagged) will do, and it is only read a batch at a time.
+        language - the language of the articles
+        batch_size - if None, the articles are flattened into one string and tagged as a single document.
+                     Otherwise each article is its own document, and they are fed to the pipeline this
+                     many at a time.
+        processors - the stanza processors to run
+        workers - if more than 1, the articles are tagged by that many processes, see run_stanza_pipeline_sharded
+        compact - if True, the stanza output is converted to a TaggedCorpus and dropped
+
+    :return:
+        a stanza Document, or a list of Documents (one per article) if batch_size or workers is given.
+        A TaggedCorpus if compact is True.
+    '''
+
+    if workers is not None and workers > 1:
+        return run_stanza_pipeline_sharded(articles, language, workers, batch_size or 16, processors, compact)
+
+    nlp = get_pipeline(language, processors)
+    if batch_size is None:
+        flattened_articles = flatten_corpus(articles)
+        with metrics.span('tagging.batch'):
+            tagged_corpus = nlp(flattened_articles)
+        metrics.incr('tagging.words', tagged_corpus.num_words)
+    elif compact:
+        tagged_corpus = tag_stream(articles, language, batch_size, processors)
+    else:
+        tagged_corpus = [doc for i, doc in iter_tagged(articles, language, batch_size, processors, compact=False)]
+
+    if compact and not isinstance(tagged_corpus, TaggedCorpus):
+        tagged_corpus = TaggedCorpus.from_documents(tagged_corpus)
     print('Tagged corpus created from NLP pipeline.\n\n\n\n')
     return tagged_corpus
 
@@ -19,25 +88,275 @@ def run_stanza_pipeline(articles, language='en'):
 
 
 
-def get_word_lemmas(corpus, language='en'):
+def iter_tagged(articles, language='en', batch_size=32, processors='tokenize,pos,lemma', compact=True):
+    '''
+    Tags articles one document at a time, pulling them from any iterable in bounded batches, so that only
+    batch_size articles are ever held at once.  The iterable can be a list, a saved corpus
+    (CorpusStore.iter_records) or the scraper itself.
+
+    :param
+        articles - an iterable of article strings, or of records with the text under 'text'
+        language - the language of the articles
+        batch_size - how many articles to read and tag at a time
+        processors - the stanza processors to run
+        compact - if True, each article is returned as a TaggedCorpus, otherwise as a stanza Document
+
+    :return:
+        a generator of (article id, tagged article) tuples, in the order of articles.  The id is the
+        article's 'link' for records, and its position in articles otherwise.
+    '''
+
+    nlp = get_pipeline(language, processors)
+    articles = iter(articles)
+    position = 0
+    while True:
+        batch = list(islice(articles, batch_size))
+        if not batch:
+            break
+
+        ids = article_ids(batch, position)
+        with metrics.span('tagging.batch'):
+            tagged = nlp([stanza.Document([], text=article_text(a)) for a in batch])
+        metrics.incr('tagging.documents', len(tagged))
+        metrics.incr('tagging.words', sum(d.num_words for d in tagged))
+        for article_id, doc in zip(ids, tagged):
+            yield article_id, TaggedCorpus.from_documents(doc, [article_id]) if compact else doc
+        position += len(batch)
+
+
+
+
+
+def article_ids(batch, position):
+    '''
+    Helper function.  Names the articles of a batch starting at position: by 'link' for records, and by
+    their position in the corpus otherwise.
+    '''
+    return [a.get('link', position + i) if isinstance(a, dict) else position + i for i, a in enumerate(batch)]
+
+
+def shards_of(articles, shard_size):
+    '''
+    Helper function.  Cuts any iterable of articles into (ids, texts) shards of shard_size, reading it lazily.
+    '''
+
+    articles = iter(articles)
+    position = 0
+    while True:
+        shard = list(islice(articles, shard_size))
+        if not shard:
+            return
+        yield article_ids(shard, position), [article_text(a) for a in shard]
+        position += len(shard)
+
+
+
+
+
+def tag_stream(articles, language='en', batch_size=32, processors='tokenize,pos,lemma'):
+    '''
+    Tags a stream of articles into one TaggedCorpus, with one document per article named by its id
+    (see iter_tagged).  Memory is bounded by the compact table plus one batch of articles, never the raw corpus.
+    '''
+
+    batches = []
+    pending = []
+    for article_id, tagged in iter_tagged(articles, language, batch_size, processors):
+        pending.append(tagged)
+        if len(pending) == batch_size:
+            batches.append(TaggedCorpus.concat(pending))
+            pending = []
+    batches.append(TaggedCorpus.concat(pending))
+    return TaggedCorpus.concat(batches)
+
+
+
+
+
+def _init_tagging_worker(language, processors):
+    #one model per process already fills a core, torch's own threads would only fight over them.
+    import torch
+    torch.set_num_threads(1)
+    get_pipeline(language, processors)
+
+
+
+
+
+def _tag_shard(shard, language, processors, compact):
+    #metrics recorded in a worker process are lost with it, so the tagging time goes back with the shard
+    ids, texts = shard
+    nlp = get_pipeline(language, processors)
+    start = time.perf_counter()
+    tagged = nlp([stanza.Document([], text=text) for text in texts])
+    seconds = time.perf_counter() - start
+    if compact:
+        return TaggedCorpus.from_documents(tagged, ids), seconds
+    return [doc.to_dict() for doc in tagged], seconds
+
+
+
+
+
+def run_stanza_pipeline_sharded(articles, language='en', workers=None, shard_size=16, processors='tokenize,pos,lemma', compact=False):
+    '''
+    Tags a corpus on several cores.  The articles are split into shards of shard_size, and the shards
+    are spread over a pool of processes, each of which loads its own pipeline once and keeps it warm.
+    The articles are read lazily, with at most two shards per worker in flight, and tagged shards are
+    streamed back in order and merged into one list of Documents.  With compact, each worker converts
+    its shard to a TaggedCorpus, which is much cheaper to send back, and the shards are merged into one
+    TaggedCorpus whose documents are named as in iter_tagged.  The tagging metrics are recorded here, from
+    what the workers send back: each shard's tagging time under tagging.batch, the time spent waiting on
+    the workers under tagging.wait, and the documents and words tagged.
+
+    Attributes:
+        shards - (ids, texts) pieces of shard_size articles, see shards_of
+        pending - the shards sent to the pool and not yet collected, in order
+        tagged_corpus - one stanza Document per article, in the same order as articles
+
+    :param
+        articles - the corpus, any iterable of article strings or records with the text under 'text'
+        language - the language of the articles
+        workers - the number of processes.  Defaults to the number of cores.
+        shard_size - the number of articles sent to a worker at a time
+        processors - the stanza processors to run
+        compact - if True, return a TaggedCorpus instead of Documents
+
+    :return:
+        a list of stanza Documents, one per article, or a TaggedCorpus if compact is True
+    '''
+
+    workers = workers or os.cpu_count()
+    shards = shards_of(articles, shard_size)
+
+    tagged_corpus = []
+    def collect(future):
+        with metrics.span('tagging.wait'):
+            shard, seconds = future.result()
+        metrics.observe('tagging.batch', seconds)
+        if compact:
+            tagged_corpus.append(shard)
+            documents, words = shard.n_documents, shard.n_words
+        else:
+            docs = [stanza.Document(doc) for doc in shard]
+            tagged_corpus.extend(docs)
+            documents, words = len(docs), sum(d.num_words for d in docs)
+        metrics.incr('tagging.documents', documents)
+        metrics.incr('tagging.words', words)
+
+    #spawn rather than fork, forking a process that has torch loaded can deadlock
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_tagging_worker,
+                             initargs=(language, processors)) as pool:
+        pending = deque()
+        for shard in shards:
+            pending.append(pool.submit(_tag_shard, shard, language, processors, compact))
+            if len(pending) >= 2 * workers:
+                collect(pending.popleft())
+        while pending:
+            collect(pending.popleft())
+    if compact:
+        tagged_corpus = TaggedCorpus.concat(tagged_corpus)
+    print('Tagged corpus created from NLP pipeline.\n\n\n\n')
+    return tagged_corpus
+
+
+
+
+
+def tagger_version(processors='tokenize,pos,lemma'):
+    '''
+    Helper function.  Identifies the tagging setup, so that corpora tagged by a different stanza
+    release or set of processors aren't reused.
+    '''
+    return 'stanza-' + stanza.__version__ + '-' + processors.replace(',', '+')
+
+
+
+
+
+def corpus_digest(articles):
+    '''
+    Helper function.  Hashes the text of a corpus, so that a re-scraped window isn't mistaken for the old one.
     '''
+
+    digest = hashlib.sha256()
+    for article in articles:
+        text = article_text(article).encode('utf-8')
+        digest.update(len(text).to_bytes(8, 'little'))
+        digest.update(text)
+    return digest.hexdigest()[:16]
+
+
+def tagged_corpus_path(keyword, language, start_date, end_date, processors='tokenize,pos,lemma', store='cache/tagged',
+                       digest=None):
     '''
+    Helper function.  Returns where the tagged corpus of a keyword, language and date window is saved.
+    digest, from corpus_digest, tells apart different corpora of the same window.
+    '''
+
+    path = os.path.join(store, keyword, language, start_date + '_' + end_date, tagger_version(processors))
+    return os.path.join(path, digest) if digest else path
 
-    lemmas = []
-    adjectives = []
-    nouns = []
-    verbs = []
-    
 
-    for sentence in corpus.sentences:
-        for word in sentence.words:
-            lemmas.append(word.lemma)
-            if word.upos == 'ADJ':
-                adjectives.append(word.lemma)
-            if word.upos == 'NOUN':
-                nouns.append(word.lemma)
-            if word.upos == 'VERB':
-                verbs.append(word.lemma)
+
+
+
+def tag_corpus(articles, keyword, language, start_date, end_date, store='cache/tagged', processors='tokenize,pos,lemma', **kwargs):
+    '''
+    Returns the tagged corpus of a keyword, language and date window, running stanza only the first
+    time.  After that the saved TaggedCorpus is memory-mapped back in, so experiments with different
+    training settings don't re-tag anything.  The store is keyed on a hash of the articles as well, so
+    re-scraping the window tags the new corpus rather than reusing the old tags.
+
+    :param
+        articles - the corpus, a list of article strings or records
+        keyword, language, start_date, end_date - what the corpus is of, used as the key in the store
+        store - the directory the tagged corpora are saved under
+        processors - the stanza processors to run
+        kwargs - passed to run_stanza_pipeline, e.g. batch_size or workers
+
+    :return:
+        a TaggedCorpus
+    '''
+
+    articles = list(articles)
+    path = tagged_corpus_path(keyword, language, start_date, end_date, processors, store, corpus_digest(articles))
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        return TaggedCorpus.load(path)
+
+    tagged_corpus = run_stanza_pipeline(articles, language, processors=processors, compact=True, **kwargs)
+    tagged_corpus.save(path, keyword=keyword, language=language, start_date=start_date,
+                       end_date=end_date, tagger=tagger_version(processors))
+    return tagged_corpus
+
+
+
+
+
+def as_tagged_corpus(corpus):
+    '''
+    Helper function.  Returns the TaggedCorpus form of a tagged corpus, converting it if it is still a
+    stanza Document or a list of them, as returned by run_stanza_pipeline without compact.
+    '''
+
+    if isinstance(corpus, TaggedCorpus):
+        return corpus
+    return TaggedCorpus.from_documents(corpus)
+
+
+
+
+
+def get_word_lemmas(corpus, language='en'):
+    '''
+    '''
+
+    corpus = as_tagged_corpus(corpus)
+    lemmas = corpus.lemmas()
+    adjectives = corpus.lemmas('ADJ')
+    nouns = corpus.lemmas('NOUN')
+    verbs = corpus.lemmas('VERB')
 
     lemmas = stopword_removal(lemmas, language)
     adjectives = stopword_removal(adjectives, language)
@@ -56,55 +375,98 @@ def get_word_lemmas(corpus, language='en'):
 #are the parts of speech that provide the most extra meaning.  Verbs do in some
 #cases.  For this reason I am weighting Adjectives and nouns higher than verbs when
 #assigning the related terms.  (.4, .4, .2)
-def related_from_most_frequent(tagged_corpus, language='en'):
+def related_from_most_frequent(tagged_corpus, language='en', pos_weights=None, k=8):
+    '''
+    Returns the k most frequent lemmas of the corpus that are used as adjectives, or, given pos_weights,
+    the k lemmas with the highest weighted count over those parts of speech, e.g. {'ADJ' : .4, 'NOUN' : .4, 'VERB' : .2}
     '''
 
+    freq = FrequencyIndex(as_tagged_corpus(tagged_corpus), exclude=get_stopwords(language))
+
+    if pos_weights:
+        words = freq.most_common(k, weights=pos_weights)
+    else:
+        words = freq.most_common(k, require='ADJ')
+
+    return [w[0] for w in words]
+
+
+
+
+
+#corpus size thresholds, in sentences, at which min_count goes up by one.  Bigger corpora can afford to
+#drop rarer words, and training is much faster without them.
+min_count_steps = [250, 1000, 3000, 6000, 10000, 13000, 16000, 20000, 25000, 35000]
+
+def min_count_for(n_sentences, smallest):
+    return smallest + bisect_left(min_count_steps, n_sentences)
+
+
+
+
+
+PreparedCorpus = namedtuple('PreparedCorpus', ['path', 'sentences', 'words'])
+
+def prepare_training_corpus(corpus, language='en', path=None):
+    '''
+    Tokenizes a tagged corpus once and writes it out in the line-delimited format that gensim's corpus_file
+    training reads: one sentence per line, tokens separated by spaces.  Training from a file lets gensim's
+    workers read it in parallel without going through Python, so it scales with cores, and the same file
+    can be passed to both related_from_word2vec and related_from_fasttext.
+
+    :param
+        corpus - the tagged corpus
+        language - the language of the corpus
+        path - where to write the file.  Defaults to a new temporary file, which the caller should delete.
+
+    :return:
+        a PreparedCorpus (path, number of sentences, number of words)
     '''
 
-    lemmas, adjectives, nouns, verbs = get_word_lemmas(tagged_corpus, language)
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.txt', prefix='corpus_')
+        os.close(fd)
+    elif os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
 
-    freq = nltk.FreqDist(lemmas)
+    sentences = words = 0
+    with open(path, 'w', encoding='utf-8') as fp:
+        for sentence in sentence_tokenize(corpus, language):
+            fp.write(' '.join(token.replace(' ', '_') for token in sentence) + '\n')
+            sentences += 1
+            words += len(sentence)
 
-    words = []
-    for i in freq.most_common():
-        if i[0] in adjectives:
-            words.append(i[0])
-        if len(words) == 8:
-            break
+    return PreparedCorpus(path, sentences, words)
 
-    return words
 
 
 
 
+def _train_from_prepared(model_class, corpus, language, min_count, **kwargs):
+    if isinstance(corpus, PreparedCorpus):
+        with metrics.span('training.' + model_class.__name__.lower()):
+            return model_class(corpus_file=corpus.path, min_count=min_count(corpus.sentences), **kwargs)
+
+    prepared = prepare_training_corpus(corpus, language)
+    try:
+        with metrics.span('training.' + model_class.__name__.lower()):
+            return model_class(corpus_file=prepared.path, min_count=min_count(prepared.sentences), **kwargs)
+    finally:
+        os.remove(prepared.path)
+
+
+
 
-def related_from_word2vec(keyword, corpus, language='en'):
-    sentences = sentence_tokenize(corpus, language)
 
-    if len(sentences) < 250:
-        min_c = 2
-    if len(sentences) > 250 and len(sentences) <= 1000:
-        min_c = 3
-    if len(sentences) > 1000 and len(sentences) <=3000:
-        min_c = 4
-    if len(sentences) > 3000 and len(sentences) <= 6000:
-        min_c = 5
-    if len(sentences) > 6000 and len(sentences) <= 10000:
-        min_c = 6
-    if len(sentences) > 10000 and len(sentences) <= 13000:
-        min_c = 7
-    if len(sentences) > 13000 and len(sentences) <= 13000:
-        min_c = 8
-    if len(sentences) > 16000 and len(sentences) <= 20000:
-        min_c = 9
-    if len(sentences) > 20000 and len(sentences) <= 25000:
-        min_c = 10
-    if len(sentences) > 25000 and len(sentences) <= 35000:
-        min_c = 11
-    if len(sentences) > 35000:
-        min_c = 12
-
-    model = Word2Vec(sentences=sentences, window=5, min_count=min_c, workers=4)
+def related_from_word2vec(keyword, corpus, language='en', window=5, workers=None):
+    '''
+    Trains Word2Vec on the corpus and returns the 8 terms closest to keyword, as (term, similarity) tuples.
+    corpus can be a tagged corpus, or a PreparedCorpus to share one tokenization with related_from_fasttext.
+    workers defaults to the number of cores.
+    '''
+
+    model = _train_from_prepared(Word2Vec, corpus, language, lambda n: min_count_for(n, 2),
+                                 window=window, workers=workers or os.cpu_count())
     similar = model.wv.most_similar(keyword)
     return similar[:8]
 
@@ -112,34 +474,15 @@ def related_from_word2vec(keyword, corpus, language='en'):
 
 
 
-def related_from_fasttext(keyword, corpus, language='en'):
-    sentences = sentence_tokenize(corpus, language)
+def related_from_fasttext(keyword, corpus, language='en', window=4, workers=None):
+    '''
+    Trains FastText on the corpus and returns the 8 terms closest to keyword, as (term, similarity) tuples.
+    corpus can be a tagged corpus, or a PreparedCorpus to share one tokenization with related_from_word2vec.
+    workers defaults to the number of cores.
+    '''
 
-    if len(sentences) < 250:
-        min_c = 1
-    if len(sentences) > 250 and len(sentences) <= 1000:
-        min_c = 2
-    if len(sentences) > 1000 and len(sentences) <=3000:
-        min_c = 3
-    if len(sentences) > 3000 and len(sentences) <= 6000:
-        min_c = 4
-    if len(sentences) > 6000 and len(sentences) <= 10000:
-        min_c = 5
-    if len(sentences) > 10000 and len(sentences) <= 13000:
-        min_c = 6
-    if len(sentences) > 13000 and len(sentences) <= 13000:
-        min_c = 7
-    if len(sentences) > 16000 and len(sentences) <= 20000:
-        min_c = 8
-    if len(sentences) > 20000 and len(sentences) <= 25000:
-        min_c = 9
-    if len(sentences) > 25000 and len(sentences) <= 35000:
-        min_c = 10
-    if len(sentences) > 35000:
-        min_c = 11
-
-
-    model = FastText(window=4, min_count=min_c, sentences=sentences, workers=4)
+    model = _train_from_prepared(FastText, corpus, language, lambda n: min_count_for(n, 1),
+                                 window=window, workers=workers or os.cpu_count())
     similar = model.wv.most_similar(keyword)
     return similar[:8]
 
@@ -147,14 +490,50 @@ def related_from_fasttext(keyword, corpus, language='en'):
 
 
 
-def stopword_removal(doc, language='en'):
-    if language == 'en':
-        stopWords = set(stopwords.words('english'))
-    if language == 'fr':
-        stopWords = set(stopwords.words('french'))
+@lru_cache(maxsize=None)
+def get_stopwords(language='en'):
+    stopWords = set()
+    if language in stopword_languages:
+        stopWords.update(stopwords.words(stopword_languages[language]))
     stopWords.update({',', '.', '’', '“', '”', ')', '(', '—', '``', '?', ':', ';', "''", '/', '–', '‘',
                      '$', '%', '[', ']', "'s", '!', "'", '-', '}', '{', '//', '"', '«', '»', 'could', 'get', 'come', 'go',
                      'also', 'might', 'many'})
+    return frozenset(stopWords)
+
+
+
+
+
+def related_incremental(keyword, corpus, label, language='en', method='word2vec', **kwargs):
+    '''
+    Like related_from_word2vec and related_from_fasttext, but for drift tracking over consecutive windows.
+    Instead of training from scratch, the corpus continues training the keyword's incremental model,
+    see incremental.IncrementalModel.  Windows should be passed in date order.
+
+    :param
+        keyword - the term to find related terms for
+        corpus - the tagged corpus of this window
+        label - names the window, e.g. its start date.  The neighbours as of an earlier window can be
+                read back with get_incremental_model(keyword, language, method).most_similar(keyword, label)
+        language - the language of the corpus
+        method - 'word2vec' or 'fasttext'
+        kwargs - passed to the model when it is first created, e.g. window or min_count
+
+    :return:
+        the 8 terms closest to keyword as of this window, as (term, similarity) tuples
+    '''
+
+    sentences = sentence_tokenize(corpus, language)
+    model = get_incremental_model(keyword, language, method, **kwargs)
+    model.update(sentences, label)
+    return model.most_similar(keyword, label)
+
+
+
+
+
+def stopword_removal(doc, language='en'):
+    stopWords = get_stopwords(language)
 
     tokens = [i for i in doc if i not in stopWords]
 
@@ -171,12 +550,8 @@ def stopword_removal(doc, language='en'):
 def sentence_tokenize(corpus, language='en'):
 
     all_sentences = []
-    for sentence in corpus.sentences:
-        new_sentence = []
-        for word in sentence.words:
-            if word.lemma != None:
-                new_sentence.append(word.lemma.lower())
-        new_sentence = stopword_removal(new_sentence, language)
+    for sentence in as_tagged_corpus(corpus).sentences(lower=True):
+        new_sentence = stopword_removal(sentence, language)
         all_sentences.append(new_sentence)
 
     return all_sentences
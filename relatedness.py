@@ -0,0 +1,456 @@
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import urllib3
+import http_client
+import metrics
+
+
+#can be pointed elsewhere, e.g. at the benchmarks' stand-in server
+CONCEPTNET_API = os.environ.get('CONCEPTNET_API', 'http://api.conceptnet.io/relatedness')
+
+
+
+
+def concept_uri(language, term):
+    '''
+    Helper function.  Returns the ConceptNet URI of a term, e.g. ('en', 'New York') -> '/c/en/new_york'
+    '''
+    return '/c/' + language + '/' + term.strip().lower().replace(' ', '_')
+
+
+
+
+def pair_key(l1, term1, l2, term2):
+    '''
+    Helper function.  Relatedness is symmetric, so a pair and its mirror image share one key.
+
+    :return:
+        a (lang1, term1, lang2, term2) tuple, with the smaller concept first
+    '''
+    a = (l1, term1.strip().lower())
+    b = (l2, term2.strip().lower())
+    if b < a:
+        a, b = b, a
+    return a + b
+
+
+
+
+
+
+
+class TokenBucket:
+    '''
+    Rate limiter.  Holds up to 'capacity' tokens, refilled at 'rate' tokens per second, and take()
+    blocks until one is available.  Lets short bursts through at full speed while keeping the
+    long-run request rate under the API's limit.
+    '''
+
+    def __init__(self, rate=0.5, capacity=60):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def take(self):
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate)
+
+
+
+
+
+
+
+class RelatednessCache:
+    '''
+    Persistent cache of relatedness scores, keyed by pair_key(), in an SQLite file.  The database
+    is opened on first use, so importing this module doesn't touch the disk.
+
+    Attributes:
+        path - the SQLite file
+        memory - scores already read or written in this process
+    '''
+
+    def __init__(self, path='cache/relatedness.sqlite'):
+        self.path = path
+        self.memory = {}
+        self.db = None
+        self.lock = threading.Lock()
+
+
+    def connect(self):
+        if self.db is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS relatedness ('
+                            'lang1 TEXT, term1 TEXT, lang2 TEXT, term2 TEXT, value REAL, '
+                            'PRIMARY KEY (lang1, term1, lang2, term2))')
+        return self.db
+
+
+    def get_many(self, keys):
+        '''
+        :return:
+            a dict of the keys that are in the cache, mapped to their score
+        '''
+
+        found = {k : self.memory[k] for k in keys if k in self.memory}
+        missing = [k for k in keys if k not in found]
+        if missing:
+            with self.lock:
+                db = self.connect()
+                for k in missing:
+                    row = db.execute('SELECT value FROM relatedness WHERE lang1=? AND term1=? AND lang2=? AND term2=?', k).fetchone()
+                    if row is not None:
+                        found[k] = self.memory[k] = row[0]
+        return found
+
+
+    def put_many(self, scores):
+        self.memory.update(scores)
+        with self.lock:
+            db = self.connect()
+            db.executemany('INSERT OR REPLACE INTO relatedness VALUES (?, ?, ?, ?, ?)',
+                           [k + (v,) for k, v in scores.items()])
+            db.commit()
+
+
+
+
+
+
+
+class ConceptNetClient:
+    '''
+    Client for the ConceptNet relatedness API.  Every pair it is asked about is deduplicated (including
+    mirrored pairs), looked up in the cache, and only the misses go to the API, a few at a time over the
+    shared HTTP client's keep-alive connections, and through a token bucket.  ConceptNet allows 3600
+    requests an hour in bursts of up to 120 a minute, and a relatedness query counts as two requests.
+
+    Attributes:
+        cache - RelatednessCache the scores are read from and written to
+        bucket - TokenBucket limiting the rate of API calls
+        http - the HttpClient requests go through, which retries 429 and 5xx responses with backoff
+        concurrency - the most API calls in flight at once
+    '''
+
+    def __init__(self, cache=None, rate=0.5, burst=60, retries=3, http=None, concurrency=4):
+        self.cache = cache if cache is not None else RelatednessCache()
+        self.bucket = TokenBucket(rate, burst)
+        self.http = http if http is not None else http_client.client
+        self.retries = retries
+        self.concurrency = concurrency
+
+
+    def fetch(self, key):
+        l1, term1, l2, term2 = key
+        params = {'node1' : concept_uri(l1, term1), 'node2' : concept_uri(l2, term2)}
+
+        self.bucket.take()
+        with metrics.span('relatedness.fetch'):
+            response = self.http.get(CONCEPTNET_API, params, retries=self.retries, timeout=30)
+        metrics.incr('relatedness.bytes', len(response.data))
+        if response.status >= 400:
+            raise urllib3.exceptions.HTTPError('ConceptNet returned HTTP ' + str(response.status) + ' for ' + str(key))
+        return json.loads(response.data)['value']
+
+
+    def relatedness_many(self, pairs):
+        '''
+        Scores a batch of term pairs.
+
+        :param
+            pairs - an iterable of (lang1, term1, lang2, term2) tuples
+
+        :return:
+            a dict mapping pair_key() of each pair to its relatedness score
+        '''
+
+        keys = list(dict.fromkeys(pair_key(*p) for p in pairs))
+        scores = self.cache.get_many(keys)
+        metrics.incr('relatedness.cache_hits', len(scores))
+        metrics.incr('relatedness.cache_misses', len(keys) - len(scores))
+
+        missing = [key for key in keys if key not in scores]
+        if missing:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.concurrency, len(missing)))) as pool:
+                futures = {pool.submit(self.fetch, key) : key for key in missing}
+                for future in as_completed(futures):
+                    key = futures[future]
+                    scores[key] = future.result()
+                    self.cache.put_many({key : scores[key]})
+        return scores
+
+
+    def relatedness(self, l1, term1, l2, term2):
+        return self.relatedness_many([(l1, term1, l2, term2)])[pair_key(l1, term1, l2, term2)]
+
+
+    def score_matrix(self, l1, l1_terms, l2, l2_terms):
+        '''
+        :return:
+            a list of rows, the score of l1_terms[i] against l2_terms[j] at [i][j]
+        '''
+
+        scores = self.relatedness_many((l1, t1, l2, t2) for t1 in l1_terms for t2 in l2_terms)
+        return [[scores[pair_key(l1, t1, l2, t2)] for t2 in l2_terms] for t1 in l1_terms]
+
+
+
+
+
+
+
+class EmbeddingBackend:
+    '''
+    Local relatedness backend, scoring pairs by the cosine similarity of their vectors in a multilingual
+    embedding table such as ConceptNet Numberbatch.  The first time a table is used it is converted to a
+    flat float32 matrix of unit-length rows plus a term index, next to the original file.  From then on the
+    matrix is memory-mapped, so opening it is instant and only the rows actually looked up are read.
+
+    Attributes:
+        matrix - the memory-mapped (terms x dimensions) float32 matrix, rows normalized to unit length
+        index - maps a term's ConceptNet URI ('/c/en/new_york') to its row in the matrix
+
+    :param
+        path - the embedding table.  Either text ('.txt' or '.txt.gz'), with a 'rows dims' header and one
+               'term v1 v2 ...' line per term, or word2vec binary ('.bin').
+        languages - if given, only terms in these languages are kept when converting
+        default_language - the language of terms that aren't ConceptNet URIs, as in monolingual tables
+    '''
+
+    def __init__(self, path, languages=None, default_language='en'):
+        self.path = path
+        prefix = path + ('.' + '-'.join(sorted(languages)) if languages else '')
+        self.matrix_path = prefix + '.f32'
+        self.index_path = prefix + '.index.json'
+
+        if not (os.path.exists(self.matrix_path) and os.path.exists(self.index_path)):
+            convert_embeddings(path, self.matrix_path, self.index_path, languages, default_language)
+
+        with open(self.index_path, encoding='utf-8') as fp:
+            header = json.load(fp)
+        self.index = {term : row for row, term in enumerate(header['terms'])}
+        self.matrix = np.memmap(self.matrix_path, dtype=np.float32, mode='r',
+                                shape=(len(header['terms']), header['dims']))
+
+
+    def vectors(self, language, terms):
+        '''
+        :return:
+            a (len(terms) x dims) array of the terms' vectors, with a row of zeros for unknown terms
+        '''
+
+        rows = [self.index.get(concept_uri(language, t), -1) for t in terms]
+        found = [i for i, row in enumerate(rows) if row >= 0]
+
+        vectors = np.zeros((len(terms), self.matrix.shape[1]), dtype=np.float32)
+        if found:
+            vectors[found] = self.matrix[[rows[i] for i in found]]
+        return vectors
+
+
+    def score_matrix(self, l1, l1_terms, l2, l2_terms):
+        '''
+        Scores every pair in one matrix product.  Pairs involving an unknown term score 0.
+
+        :return:
+            a (len(l1_terms) x len(l2_terms)) array, the score of l1_terms[i] against l2_terms[j] at [i, j]
+        '''
+
+        return self.vectors(l1, l1_terms) @ self.vectors(l2, l2_terms).T
+
+
+    def relatedness(self, l1, term1, l2, term2):
+        return float(self.score_matrix(l1, [term1], l2, [term2])[0, 0])
+
+
+
+
+
+def read_embeddings(path, default_language='en'):
+    '''
+    Helper function.  Streams (ConceptNet URI, vector) pairs out of a text or word2vec binary embedding table.
+    '''
+
+    def uri(term):
+        if term.startswith('/c/'):
+            return term
+        return concept_uri(default_language, term)
+
+    if path.endswith('.bin'):
+        with open(path, 'rb') as fp:
+            rows, dims = map(int, fp.readline().split())
+            for _ in range(rows):
+                term = b''
+                while True:
+                    ch = fp.read(1)
+                    if ch == b' ' or ch == b'':
+                        break
+                    if ch != b'\n':
+                        term += ch
+                vector = np.frombuffer(fp.read(4 * dims), dtype='<f4')
+                yield uri(term.decode('utf-8', errors='replace')), vector
+        return
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as fp:
+        first = fp.readline().split()
+        if len(first) != 2:
+            yield uri(first[0]), np.asarray(first[1:], dtype=np.float32)
+        for line in fp:
+            parts = line.rstrip().split(' ')
+            yield uri(parts[0]), np.asarray(parts[1:], dtype=np.float32)
+
+
+
+
+
+def convert_embeddings(path, matrix_path, index_path, languages=None, default_language='en'):
+    '''
+    Converts an embedding table to the layout EmbeddingBackend memory-maps: the unit-normalized rows
+    written back to back as raw float32, and a JSON file holding the dimension count and row order.
+    '''
+
+    prefixes = tuple('/c/' + l + '/' for l in languages) if languages else None
+    terms = []
+    dims = None
+    with open(matrix_path + '.tmp', 'wb') as out:
+        for term, vector in read_embeddings(path, default_language):
+            if prefixes and not term.startswith(prefixes):
+                continue
+            dims = len(vector)
+            norm = np.linalg.norm(vector)
+            out.write((vector / norm if norm else vector).astype(np.float32).tobytes())
+            terms.append(term)
+
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as fp:
+        json.dump({'dims' : dims, 'terms' : terms}, fp)
+    os.replace(matrix_path + '.tmp', matrix_path)
+    os.replace(index_path + '.tmp', index_path)
+
+
+
+
+
+
+def term_list(terms):
+    '''
+    Helper function.  Accepts a list of terms, or of (term, score) tuples as returned by the related_from_* methods.
+    '''
+    return [t[0] if isinstance(t, tuple) else t for t in terms]
+
+
+
+
+
+def score_tensor(l1, l2, l1_terms, l2_terms, backend=None):
+    '''
+    Scores the term lists of several methods over several days in one batch.  The terms of every method and
+    day are gathered into one set of unique terms per language, so a term that turns up on many days, or
+    from several methods, is looked up once.  Each unique pair is scored once by the backend: the whole
+    (unique l1 terms x unique l2 terms) matrix for backends that score matrices locally, and only the pairs
+    that are actually compared for ConceptNet, where every pair is an API call.  The per-day, per-method
+    comparisons are then gathered out of that matrix with one fancy-indexing step.
+
+    :param
+        l1 - language code of l1_terms
+        l2 - language code of l2_terms
+        l1_terms - dict mapping each method to a list with one term list per day, e.g.
+                   {'frequency' : [day1_terms, day2_terms, ...], 'word2vec' : [...]}
+        l2_terms - same, in l2, with the same methods
+        backend - a ConceptNetClient or EmbeddingBackend.  Defaults to default_backend.
+
+    :return:
+        a (methods, tensor) tuple.  tensor is a (methods x days x n1 x n2) array where tensor[m, d, i, j]
+        scores term i of method m's l1 list on day d against term j of its l2 list, and is 0 past the end
+        of shorter lists.
+    '''
+
+    if backend is None:
+        backend = default_backend
+
+    methods = list(l1_terms)
+    days = min(min(len(l1_terms[m]), len(l2_terms[m])) for m in methods) if methods else 0
+    lists1 = [[term_list(l1_terms[m][d]) for d in range(days)] for m in methods]
+    lists2 = [[term_list(l2_terms[m][d]) for d in range(days)] for m in methods]
+
+    vocab1 = list(dict.fromkeys(t for per_day in lists1 for terms in per_day for t in terms))
+    vocab2 = list(dict.fromkeys(t for per_day in lists2 for terms in per_day for t in terms))
+    index1 = {t : i for i, t in enumerate(vocab1)}
+    index2 = {t : i for i, t in enumerate(vocab2)}
+
+    def padded(lists, index):
+        width = max([len(terms) for per_day in lists for terms in per_day] + [0])
+        ids = np.full((len(methods), days, width), -1, dtype=np.int64)
+        for m, per_day in enumerate(lists):
+            for d, terms in enumerate(per_day):
+                ids[m, d, :len(terms)] = [index[t] for t in terms]
+        return ids
+
+    ids1 = padded(lists1, index1)
+    ids2 = padded(lists2, index2)
+
+    if hasattr(backend, 'relatedness_many'):
+        i1 = np.broadcast_to(ids1[..., :, None], ids1.shape + ids2.shape[-1:])
+        i2 = np.broadcast_to(ids2[..., None, :], ids1.shape + ids2.shape[-1:])
+        used = (i1 >= 0) & (i2 >= 0)
+        needed = set(zip(i1[used].tolist(), i2[used].tolist()))
+        scores = backend.relatedness_many((l1, vocab1[a], l2, vocab2[b]) for a, b in needed)
+        matrix = np.zeros((len(vocab1) + 1, len(vocab2) + 1), dtype=np.float64)
+        for a, b in needed:
+            matrix[a, b] = scores[pair_key(l1, vocab1[a], l2, vocab2[b])]
+    else:
+        matrix = np.zeros((len(vocab1) + 1, len(vocab2) + 1), dtype=np.float64)
+        if vocab1 and vocab2:
+            matrix[:-1, :-1] = np.asarray(backend.score_matrix(l1, vocab1, l2, vocab2))
+
+    #padding ids are -1, which pick the matrix's last row and column, kept at 0
+    tensor = matrix[ids1[..., :, None], ids2[..., None, :]]
+    return methods, tensor
+
+
+
+
+
+def daily_scores(l1, l2, l1_terms, l2_terms, backend=None):
+    '''
+    Sums each day's scores, as visualize_drift takes them.  See score_tensor for the parameters.
+
+    :return:
+        a dict mapping each method to a list of its summed relatedness score per day
+    '''
+
+    with metrics.span('relatedness.score'):
+        methods, tensor = score_tensor(l1, l2, l1_terms, l2_terms, backend)
+    sums = tensor.sum(axis=(2, 3))
+    return {method : sums[m].tolist() for m, method in enumerate(methods)}
+
+
+
+
+
+
+#shared by everything in the process, so that pairs are only ever fetched once.
+conceptnet = ConceptNetClient()
+
+#what the scoring functions in data_vis use when they aren't given a client.  Can be replaced with an
+#EmbeddingBackend to score offline, e.g.  relatedness.default_backend = EmbeddingBackend('numberbatch.txt.gz')
+default_backend = conceptnet
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import threading
+from article_cache import canonical_url
+
+
+
+
+class SeenIndex:
+    '''
+    Persistent set of the article URLs that have already been scraped, so that an article is only
+    downloaded and tagged once across date windows and runs.  Keep one index per corpus (keyword and
+    language), as an article skipped because another corpus has it is missing from this one.  URLs are canonicalized and
+    stored as 8-byte BLAKE2 hashes, appended to a flat file as they are added and read back into an
+    in-memory set on first use.  Even a million URLs only take 8 MB on disk.
+
+    A scrape that only wants its articles marked once they are saved can claim them instead: a claimed URL
+    counts as seen for everyone else, but isn't written to the file until it is added, and can be released
+    if the scrape fails.
+
+    Attributes:
+        path - the file the hashes are stored in
+        hashes - the set of hashes, None until loaded
+        claimed - the hashes of URLs claimed but not yet added, kept in memory only
+        lock - guards 'hashes', 'claimed' and the file, build_corpus adds from several threads
+    '''
+
+    def __init__(self, path='cache/seen_urls.bin'):
+        self.path = path
+        self.hashes = None
+        self.claimed = set()
+        self.lock = threading.Lock()
+
+
+    @staticmethod
+    def hash(url):
+        return hashlib.blake2b(canonical_url(url).encode('utf-8'), digest_size=8).digest()
+
+
+    def load(self):
+        if self.hashes is None:
+            self.hashes = set()
+            if os.path.exists(self.path):
+                with open(self.path, 'rb') as fp:
+                    data = fp.read()
+                #drop a torn write at the end of the file, so that new hashes stay aligned
+                if len(data) % 8:
+                    data = data[:len(data) - len(data) % 8]
+                    os.truncate(self.path, len(data))
+                self.hashes.update(data[i:i + 8] for i in range(0, len(data), 8))
+        return self.hashes
+
+
+    def __contains__(self, url):
+        h = self.hash(url)
+        with self.lock:
+            return h in self.load() or h in self.claimed
+
+
+    def __len__(self):
+        with self.lock:
+            return len(self.load())
+
+
+    def add(self, url):
+        '''
+        Adds a URL to the index.
+
+        :return:
+            True if the URL was new, False if it had been seen before
+        '''
+
+        h = self.hash(url)
+        with self.lock:
+            self.claimed.discard(h)
+            hashes = self.load()
+            if h in hashes:
+                return False
+            hashes.add(h)
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'ab') as fp:
+                fp.write(h)
+            return True
+
+
+    def claim(self, url):
+        '''
+        Marks a URL as being scraped, without writing it to the file.  See add and release.
+
+        :return:
+            True if the URL was neither seen nor claimed before, and is now the caller's to scrape
+        '''
+
+        h = self.hash(url)
+        with self.lock:
+            if h in self.load() or h in self.claimed:
+                return False
+            self.claimed.add(h)
+            return True
+
+
+    def release(self, url):
+        '''
+        Gives up a claim, so the URL can be scraped again.
+        '''
+
+        with self.lock:
+            self.claimed.discard(self.hash(url))
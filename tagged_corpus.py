@@ -0,0 +1,305 @@
+from array import array
+import gzip
+import json
+import os
+import numpy as np
+
+
+#the word columns, saved as one .npy file each so that they can be memory-mapped back in
+COLUMNS = ('lemma_ids', 'upos_ids', 'sent_offsets', 'doc_offsets')
+
+#the universal POS tags, in a fixed order so that upos ids mean the same thing in every corpus.
+UPOS_TAGS = ('ADJ', 'ADP', 'ADV', 'AUX', 'CCONJ', 'DET', 'INTJ', 'NOUN', 'NUM',
+             'PART', 'PRON', 'PROPN', 'PUNCT', 'SCONJ', 'SYM', 'VERB', 'X')
+UPOS_IDS = {tag : i for i, tag in enumerate(UPOS_TAGS)}
+
+
+
+
+class TaggedCorpus:
+    '''
+    Compact, column-oriented form of a tagged corpus.  Holds only what the analysis functions use,
+    the lemma and UPOS tag of each word plus sentence and document boundaries, as flat numpy arrays
+    over an interned lemma vocabulary.  Takes a small fraction of the memory of the stanza Documents it
+    is built from, which can be dropped once it exists.
+
+    Attributes:
+        vocab - list of the distinct lemmas.  A lemma id is an index into it.
+        lemma_ids - int32 array, the lemma id of each word in the corpus, or -1 when stanza gave no lemma
+        upos_ids - int8 array, the index into UPOS_TAGS of each word's tag, or -1 for an unknown tag
+        sent_offsets - int64 array, sentence i is words sent_offsets[i] to sent_offsets[i + 1]
+        doc_offsets - int64 array, document i is sentences doc_offsets[i] to doc_offsets[i + 1]
+        doc_ids - optional list naming each document, e.g. the article's link.  None if not known.
+    '''
+
+    def __init__(self, vocab, lemma_ids, upos_ids, sent_offsets, doc_offsets, doc_ids=None):
+        self.vocab = vocab
+        self.lemma_ids = lemma_ids
+        self.upos_ids = upos_ids
+        self.sent_offsets = sent_offsets
+        self.doc_offsets = doc_offsets
+        self.doc_ids = doc_ids
+        self._lower_vocab = None
+
+
+    @classmethod
+    def from_documents(cls, docs, doc_ids=None):
+        '''
+        Builds the table from a stanza Document or a list of them, walking each Document only once.
+        doc_ids optionally names each Document.
+        '''
+
+        if hasattr(docs, 'sentences'):
+            docs = [docs]
+
+        vocab = []
+        lemma_index = {}
+        lemma_ids = array('i')
+        upos_ids = array('b')
+        sent_offsets = array('q', [0])
+        doc_offsets = array('q', [0])
+
+        for doc in docs:
+            for sentence in doc.sentences:
+                for word in sentence.words:
+                    lemma = word.lemma
+                    if lemma is None:
+                        lemma_ids.append(-1)
+                    else:
+                        if lemma not in lemma_index:
+                            lemma_index[lemma] = len(vocab)
+                            vocab.append(lemma)
+                        lemma_ids.append(lemma_index[lemma])
+                    upos_ids.append(UPOS_IDS.get(word.upos, -1))
+                sent_offsets.append(len(lemma_ids))
+            doc_offsets.append(len(sent_offsets) - 1)
+
+        return cls(vocab,
+                   np.frombuffer(lemma_ids, dtype=np.int32),
+                   np.frombuffer(upos_ids, dtype=np.int8),
+                   np.frombuffer(sent_offsets, dtype=np.int64),
+                   np.frombuffer(doc_offsets, dtype=np.int64),
+                   list(doc_ids) if doc_ids is not None else None)
+
+
+    @classmethod
+    def concat(cls, corpora):
+        '''
+        Merges several tables into one, remapping lemma ids onto a shared vocabulary.
+        '''
+
+        corpora = list(corpora)
+        doc_ids = None
+        if any(corpus.doc_ids is not None for corpus in corpora):
+            doc_ids = [i for corpus in corpora for i in (corpus.doc_ids or [None] * corpus.n_documents)]
+
+        vocab = []
+        lemma_index = {}
+        lemma_ids, upos_ids, sent_offsets, doc_offsets = [], [], [np.zeros(1, np.int64)], [np.zeros(1, np.int64)]
+        words = sentences = 0
+
+        for corpus in corpora:
+            remap = np.empty(len(corpus.vocab) + 1, dtype=np.int32)
+            remap[-1] = -1
+            for i, lemma in enumerate(corpus.vocab):
+                if lemma not in lemma_index:
+                    lemma_index[lemma] = len(vocab)
+                    vocab.append(lemma)
+                remap[i] = lemma_index[lemma]
+
+            lemma_ids.append(remap[corpus.lemma_ids])
+            upos_ids.append(corpus.upos_ids)
+            sent_offsets.append(corpus.sent_offsets[1:] + words)
+            doc_offsets.append(corpus.doc_offsets[1:] + sentences)
+            words += len(corpus.lemma_ids)
+            sentences += corpus.n_sentences
+
+        return cls(vocab,
+                   np.concatenate(lemma_ids) if lemma_ids else np.zeros(0, np.int32),
+                   np.concatenate(upos_ids) if upos_ids else np.zeros(0, np.int8),
+                   np.concatenate(sent_offsets),
+                   np.concatenate(doc_offsets),
+                   doc_ids)
+
+
+    @property
+    def n_words(self):
+        return len(self.lemma_ids)
+
+
+    @property
+    def n_sentences(self):
+        return len(self.sent_offsets) - 1
+
+
+    @property
+    def n_documents(self):
+        return len(self.doc_offsets) - 1
+
+
+    def save(self, directory, **meta):
+        '''
+        Saves the table to a directory: each column as a raw .npy file, which the columns' small integer
+        types already keep compact and which can be memory-mapped, and the vocabulary as gzipped JSON.
+        Any keyword arguments are stored alongside in meta.json.  The directory is written under a
+        temporary name and renamed at the end, so an interrupted save never looks complete.
+        '''
+
+        tmp = directory.rstrip('/\\') + '.tmp'
+        os.makedirs(tmp, exist_ok=True)
+        for column in COLUMNS:
+            np.save(os.path.join(tmp, column + '.npy'), getattr(self, column))
+        with gzip.open(os.path.join(tmp, 'vocab.json.gz'), 'wt', encoding='utf-8') as fp:
+            json.dump(self.vocab, fp)
+        if self.doc_ids is not None:
+            with gzip.open(os.path.join(tmp, 'doc_ids.json.gz'), 'wt', encoding='utf-8') as fp:
+                json.dump(self.doc_ids, fp)
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as fp:
+            json.dump(dict(meta, words=self.n_words, sentences=self.n_sentences, documents=self.n_documents), fp)
+
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+        os.replace(tmp, directory)
+
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        '''
+        Loads a table saved with save().  With mmap, the columns are memory-mapped read-only rather than read.
+        '''
+
+        columns = [np.load(os.path.join(directory, column + '.npy'), mmap_mode='r' if mmap else None)
+                   for column in COLUMNS]
+        with gzip.open(os.path.join(directory, 'vocab.json.gz'), 'rt', encoding='utf-8') as fp:
+            vocab = json.load(fp)
+        doc_ids = None
+        if os.path.exists(os.path.join(directory, 'doc_ids.json.gz')):
+            with gzip.open(os.path.join(directory, 'doc_ids.json.gz'), 'rt', encoding='utf-8') as fp:
+                doc_ids = json.load(fp)
+        return cls(vocab, *columns, doc_ids)
+
+
+    def document(self, i):
+        '''
+        :return:
+            document i on its own, as a TaggedCorpus sharing this one's vocabulary and arrays
+        '''
+
+        first, last = int(self.doc_offsets[i]), int(self.doc_offsets[i + 1])
+        sent_offsets = self.sent_offsets[first:last + 1]
+        words = slice(int(sent_offsets[0]), int(sent_offsets[-1]))
+        return TaggedCorpus(self.vocab, self.lemma_ids[words], self.upos_ids[words], sent_offsets - sent_offsets[0],
+                            np.array([0, last - first], dtype=np.int64),
+                            [self.doc_ids[i]] if self.doc_ids is not None else None)
+
+
+    def lemma_vocab(self, lower=False):
+        if not lower:
+            return self.vocab
+        if self._lower_vocab is None:
+            self._lower_vocab = [lemma.lower() for lemma in self.vocab]
+        return self._lower_vocab
+
+
+    def lemmas(self, upos=None):
+        '''
+        :param
+            upos - if given, only the lemmas of words with this UPOS tag, e.g. 'ADJ'
+
+        :return:
+            a list of the lemmas of the corpus, in order, one per word that has a lemma
+        '''
+
+        ids = self.lemma_ids
+        if upos is not None:
+            ids = ids[self.upos_ids == UPOS_IDS[upos]]
+        vocab = self.vocab
+        return [vocab[i] for i in ids[ids >= 0].tolist()]
+
+
+    def sentences(self, lower=False):
+        '''
+        Yields each sentence as a list of its lemmas, skipping words without one.
+        '''
+
+        vocab = self.lemma_vocab(lower)
+        offsets = self.sent_offsets.tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield [vocab[i] for i in self.lemma_ids[start:end].tolist() if i >= 0]
+
+
+
+
+
+
+
+class FrequencyIndex:
+    '''
+    Lemma counts of a TaggedCorpus, overall and per UPOS tag, built in a single pass over the word columns.
+    Answers "the k most frequent lemmas" for a tag, or for a weighted mix of tags, without sorting or
+    scanning Python lists of the whole vocabulary.
+
+    Attributes:
+        vocab - the corpus' lemma vocabulary
+        by_upos - (tags + 1) x vocab array.  by_upos[t, i] counts lemma i tagged UPOS_TAGS[t].  The
+                  last row counts words with an unknown tag.
+        total - the count of each lemma over all tags
+
+    :param
+        corpus - the TaggedCorpus to count
+        exclude - lemmas to leave out, such as stopwords
+    '''
+
+    def __init__(self, corpus, exclude=()):
+        self.vocab = corpus.vocab
+        n_lemmas = len(self.vocab)
+        n_tags = len(UPOS_TAGS) + 1
+
+        has_lemma = corpus.lemma_ids >= 0
+        lemma_ids = corpus.lemma_ids[has_lemma].astype(np.int64)
+        upos_ids = corpus.upos_ids[has_lemma].astype(np.int64)
+        upos_ids[upos_ids < 0] = n_tags - 1
+
+        self.by_upos = np.bincount(upos_ids * n_lemmas + lemma_ids, minlength=n_tags * n_lemmas).reshape(n_tags, n_lemmas)
+        if exclude:
+            excluded = [i for i, lemma in enumerate(self.vocab) if lemma in exclude]
+            self.by_upos[:, excluded] = 0
+        self.total = self.by_upos.sum(axis=0)
+
+
+    def count(self, upos=None):
+        if upos is None:
+            return self.total
+        return self.by_upos[UPOS_IDS[upos]]
+
+
+    def most_common(self, k=8, upos=None, weights=None, require=None):
+        '''
+        :param
+            k - how many lemmas to return
+            upos - rank by the count of this tag only.  By default the count over all tags is used.
+            weights - rank by a weighted sum of tag counts instead, e.g. {'ADJ' : .4, 'NOUN' : .4, 'VERB' : .2}
+            require - only consider lemmas that occur at least once with this tag
+
+        :return:
+            a list of up to k (lemma, score) tuples, highest score first
+        '''
+
+        if weights:
+            scores = sum(w * self.count(tag) for tag, w in weights.items())
+        else:
+            scores = self.count(upos)
+        if require is not None:
+            scores = np.where(self.count(require) > 0, scores, 0)
+
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        #every lemma tied with the k-th score is a candidate, and ties are broken by lemma id, which is the
+        #order of first occurrence, as in FreqDist.most_common
+        kth = -np.partition(-scores, k - 1)[k - 1]
+        candidates = np.flatnonzero(scores >= kth)
+        top = candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+        return [(self.vocab[i], scores[i].item()) for i in top]
@@ -0,0 +1,45 @@
+import random
+import nltk
+from stanza.models.common.doc import Document
+import nlp_analysis as nlp
+
+
+LEMMAS = ['big', 'small', 'red', 'old', 'new', 'town', 'river', 'go', 'see', 'the', ',', 'many', 'fast', 'slow']
+TAGS = ['ADJ', 'NOUN', 'VERB', 'DET', 'PUNCT']
+
+
+def random_document(rng):
+    sentences = []
+    for _ in range(rng.randint(1, 6)):
+        sentences.append([{'id' : i + 1, 'text' : lemma, 'lemma' : lemma, 'upos' : rng.choice(TAGS)}
+                          for i, lemma in enumerate(rng.choices(LEMMAS, k=rng.randint(1, 12)))])
+    return Document(sentences)
+
+
+def baseline_most_frequent(doc, language):
+    '''
+    related_from_most_frequent as it was before FrequencyIndex: a FreqDist over every lemma, keeping the
+    most common ones that occur at least once as adjectives.
+    '''
+
+    lemmas = [w.lemma for s in doc.sentences for w in s.words]
+    adjectives = [w.lemma for s in doc.sentences for w in s.words if w.upos == 'ADJ']
+    lemmas = nlp.stopword_removal(lemmas, language)
+    adjectives = nlp.stopword_removal(adjectives, language)
+
+    words = []
+    for lemma, count in nltk.FreqDist(lemmas).most_common():
+        if lemma in adjectives:
+            words.append(lemma)
+        if len(words) == 8:
+            break
+    return words
+
+
+def test_matches_freqdist_baseline():
+    #a language without an nltk stopword list, so only the punctuation and extra words are removed
+    language = 'xx'
+    rng = random.Random(0)
+    for _ in range(200):
+        doc = random_document(rng)
+        assert nlp.related_from_most_frequent(doc, language) == baseline_most_frequent(doc, language)